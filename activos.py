@@ -0,0 +1,187 @@
+# activos.py
+"""Archivos estáticos servidos desde memoria, ya comprimidos.
+
+Al arrancar se lee todo `static/` una vez: cada archivo queda en memoria
+con su versión gzip (y brotli si está instalado el paquete `brotli`), su
+ETag y un hash de contenido. Las páginas HTML se reescriben para pedir
+scripts, estilos e imágenes por su URL con hash (`script.1a2b3c4d.js`), que
+se sirven con caché de un año; las URLs sin hash se revalidan con el ETag.
+
+Con `recargar=True` (TRIKI_ACTIVOS_RECARGA=1, pensado para desarrollo) se
+revisan las fechas de modificación como mucho una vez por segundo y se
+recarga todo si algo cambió.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él solo se ofrece gzip
+    brotli = None
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+_COMPRIMIBLES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_CON_HASH = re.compile(r"^(?P<base>.+)\.(?P<hash>[0-9a-f]{8})(?P<ext>\.[^./]+)$")
+_REFERENCIA = re.compile(r'(?P<attr>\b(?:src|href))="(?P<url>[^"]+)"')
+
+
+class Activo:
+    __slots__ = ("ruta", "tipo", "cuerpo", "gzip", "br", "hash", "mtime")
+
+    def __init__(self, ruta: str, tipo: str, cuerpo: bytes, mtime: float):
+        self.ruta = ruta
+        self.tipo = tipo
+        self.mtime = mtime
+        self.cuerpo = cuerpo
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        self.hash = ""
+        self.preparar(cuerpo)
+
+    def preparar(self, cuerpo: bytes):
+        """Fija el contenido y calcula hash y versiones comprimidas."""
+        self.cuerpo = cuerpo
+        self.hash = hashlib.sha256(cuerpo).hexdigest()[:16]
+        self.gzip = self.br = None
+        if self.tipo.startswith(_COMPRIMIBLES):
+            comprimido = gzip.compress(cuerpo, compresslevel=9, mtime=0)
+            if len(comprimido) < len(cuerpo):
+                self.gzip = comprimido
+            if brotli is not None:
+                comprimido = brotli.compress(cuerpo, quality=11)
+                if len(comprimido) < len(cuerpo):
+                    self.br = comprimido
+
+    def etag(self, codificacion: str) -> str:
+        return f'"{self.hash}-{codificacion}"' if codificacion else f'"{self.hash}"'
+
+    @property
+    def url_con_hash(self) -> str:
+        base, ext = os.path.splitext(self.ruta)
+        return f"{base}.{self.hash[:8]}{ext}"
+
+
+def _codificacion_preferida(accept_encoding: str, activo: Activo) -> str:
+    aceptadas = set()
+    for parte in accept_encoding.split(","):
+        nombre, _, params = parte.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        aceptadas.add(nombre.strip().lower())
+    if activo.br is not None and "br" in aceptadas:
+        return "br"
+    if activo.gzip is not None and ("gzip" in aceptadas or "*" in aceptadas):
+        return "gzip"
+    return ""
+
+
+def etag_coincide(si_no_coincide: str, etag: str) -> bool:
+    """If-None-Match admite `*`, listas y ETags débiles (W/), que comparan igual."""
+    if not si_no_coincide:
+        return False
+    if si_no_coincide.strip() == "*":
+        return True
+    return etag in (e.strip().removeprefix("W/") for e in si_no_coincide.split(","))
+
+
+class Activos:
+    def __init__(self, directorio: str = "static", prefijo: str = "/static", recargar: bool = False):
+        self.directorio = directorio
+        self.prefijo = prefijo.rstrip("/")
+        self.recargar = recargar
+        self._activos: Dict[str, Activo] = {}
+        self._revisado = 0.0
+        self.cargar()
+
+    def cargar(self):
+        activos = {}
+        for raiz, _, archivos in os.walk(self.directorio):
+            for archivo in archivos:
+                camino = os.path.join(raiz, archivo)
+                ruta = os.path.relpath(camino, self.directorio).replace(os.sep, "/")
+                tipo = mimetypes.guess_type(archivo)[0] or "application/octet-stream"
+                if tipo.startswith("text/") or tipo == "application/javascript":
+                    tipo += "; charset=utf-8"
+                with open(camino, "rb") as f:
+                    activos[ruta] = Activo(ruta, tipo, f.read(), os.path.getmtime(camino))
+
+        # Las páginas piden los demás archivos por su URL con hash
+        for activo in activos.values():
+            if activo.tipo.startswith("text/html"):
+                html = activo.cuerpo.decode("utf-8")
+                carpeta = os.path.dirname(activo.ruta)
+                html = _REFERENCIA.sub(lambda m: self._con_hash(m, carpeta, activos), html)
+                activo.preparar(html.encode("utf-8"))
+        self._activos = activos
+        self._revisado = time.monotonic()
+
+    def _con_hash(self, coincidencia, carpeta: str, activos: Dict[str, Activo]) -> str:
+        url = coincidencia.group("url")
+        if url.startswith(self.prefijo + "/"):
+            ruta = url[len(self.prefijo) + 1:]
+        elif "://" in url or url.startswith(("/", "#", "data:", "mailto:")):
+            return coincidencia.group(0)
+        else:
+            ruta = os.path.normpath(os.path.join(carpeta, url)).replace(os.sep, "/")
+        activo = activos.get(ruta)
+        if activo is None or activo.tipo.startswith("text/html"):
+            return coincidencia.group(0)
+        return f'{coincidencia.group("attr")}="{self.prefijo}/{activo.url_con_hash}"'
+
+    def _revisar_cambios(self):
+        ahora = time.monotonic()
+        if ahora - self._revisado < 1:
+            return
+        self._revisado = ahora
+        cambiaron = False
+        for raiz, _, archivos in os.walk(self.directorio):
+            for archivo in archivos:
+                camino = os.path.join(raiz, archivo)
+                ruta = os.path.relpath(camino, self.directorio).replace(os.sep, "/")
+                activo = self._activos.get(ruta)
+                if activo is None or os.path.getmtime(camino) != activo.mtime:
+                    cambiaron = True
+        if cambiaron or any(not os.path.exists(os.path.join(self.directorio, r)) for r in self._activos):
+            self.cargar()
+
+    def _buscar(self, ruta: str) -> Tuple[Activo, bool]:
+        """(activo, pedido_con_hash). 404 si no existe o el hash es de otra versión."""
+        activo = self._activos.get(ruta)
+        if activo is not None:
+            return activo, False
+        coincidencia = _CON_HASH.match(ruta)
+        if coincidencia:
+            activo = self._activos.get(coincidencia.group("base") + coincidencia.group("ext"))
+            if activo is not None and activo.hash.startswith(coincidencia.group("hash")):
+                return activo, True
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    def responder(self, ruta: str, request: Request) -> Response:
+        if self.recargar:
+            self._revisar_cambios()
+        activo, con_hash = self._buscar(ruta)
+        codificacion = _codificacion_preferida(request.headers.get("accept-encoding", ""), activo)
+        etag = activo.etag(codificacion)
+        cabeceras = {
+            "ETag": etag,
+            "Cache-Control": CACHE_INMUTABLE if con_hash else CACHE_REVALIDAR,
+        }
+        if activo.gzip is not None or activo.br is not None:
+            cabeceras["Vary"] = "Accept-Encoding"
+
+        if etag_coincide(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=cabeceras)
+
+        cuerpo = {"br": activo.br, "gzip": activo.gzip}.get(codificacion) or activo.cuerpo
+        if codificacion:
+            cabeceras["Content-Encoding"] = codificacion
+        return Response(cuerpo, media_type=activo.tipo, headers=cabeceras)
@@ -0,0 +1,177 @@
+# admision.py
+"""Control de admisión y validación rápida para el socket de juego.
+
+Antes de tocar una sala, cada mensaje pasa por:
+
+1. Tope de tamaño: se descarta sin parsear si supera `max_bytes`.
+2. Cubetas de tokens: una por socket y una compartida por IP; si alguna
+   está vacía el mensaje se descarta.
+3. Esquema precompilado por acción (`join`, `resume`, `move`, `reset`, `resync`):
+   tipos exactos (un `true` no pasa por posición 1, ni "3" por 3) y límites.
+
+Para conexiones nuevas hay un tope global, uno por IP y, si el event loop
+va atrasado más de `umbral_lag_ms`, se rechazan hasta que se recupere.
+"""
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+from metricas import Contador, Medidor
+
+RECHAZOS = Contador("triki_admision_rechazos_total", "Conexiones o mensajes rechazados", ["motivo"])
+LAG_BUCLE = Medidor("triki_bucle_lag_segundos", "Atraso medido del event loop")
+
+MAX_NOMBRE = 40
+
+# acción -> ((campo, tipo, obligatorio), ...); bool no es int para el esquema
+_ESQUEMAS = {
+    "join": (("name", str, True), ("protocol", int, False), ("binary", bool, False)),
+    "resume": (("name", str, True), ("token", str, True), ("seq", int, False),
+               ("protocol", int, False), ("binary", bool, False)),
+    "move": (("position", int, True),),
+    "reset": (),
+    "resync": (),
+}
+
+
+class MensajeInvalido(ValueError):
+    pass
+
+
+def validar_mensaje(texto: Optional[str], max_bytes: int) -> dict:
+    """Parsea y valida un mensaje del cliente. Lanza MensajeInvalido."""
+    if texto is None:
+        raise MensajeInvalido("Se esperaba un mensaje de texto")
+    if len(texto) > max_bytes or (not texto.isascii() and len(texto.encode("utf-8")) > max_bytes):
+        raise MensajeInvalido("Mensaje demasiado grande")
+    try:
+        data = json.loads(texto)
+    except ValueError:
+        raise MensajeInvalido("JSON inválido") from None
+    if type(data) is not dict:
+        raise MensajeInvalido("Se esperaba un objeto")
+    accion = data.get("action")
+    esquema = _ESQUEMAS.get(accion) if type(accion) is str else None
+    if esquema is None:
+        raise MensajeInvalido("Acción desconocida")
+    for campo, tipo, obligatorio in esquema:
+        valor = data.get(campo)
+        if valor is None:
+            if obligatorio:
+                raise MensajeInvalido(f"Falta {campo}")
+            continue
+        if type(valor) is not tipo:
+            raise MensajeInvalido(f"Tipo inválido para {campo}")
+        # Límites: solo sobre campos del esquema y ya con su tipo comprobado
+        if campo == "position" and valor < 0:
+            raise MensajeInvalido("Posición inválida")
+        if campo == "name" and not 0 < len(valor) <= MAX_NOMBRE:
+            raise MensajeInvalido(f"El nombre debe tener entre 1 y {MAX_NOMBRE} caracteres")
+    return data
+
+
+class CubetaTokens:
+    """`tasa` tokens por segundo, hasta `capacidad` acumulados."""
+    __slots__ = ("tasa", "capacidad", "tokens", "ultimo")
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.ultimo = time.monotonic()
+
+    def tomar(self, cantidad: float = 1.0) -> bool:
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+        if self.tokens < cantidad:
+            return False
+        self.tokens -= cantidad
+        return True
+
+
+class ControlAdmision:
+    def __init__(self, max_conexiones: int = 10000, max_por_ip: int = 100,
+                 tasa_socket: float = 20, rafaga_socket: float = 40,
+                 tasa_ip: float = 200, rafaga_ip: float = 400,
+                 umbral_lag_ms: float = 200, intervalo_lag_ms: float = 100):
+        self.max_conexiones = max_conexiones
+        self.max_por_ip = max_por_ip
+        self.tasa_socket, self.rafaga_socket = tasa_socket, rafaga_socket
+        self.tasa_ip, self.rafaga_ip = tasa_ip, rafaga_ip
+        self.umbral_lag_ms = umbral_lag_ms
+        self.intervalo = intervalo_lag_ms / 1000
+        self.conexiones = 0
+        # ip -> [conexiones abiertas, cubeta compartida]
+        self._por_ip: Dict[str, list] = {}
+        self.lag_ms = 0.0
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def iniciar(self):
+        self._tarea = asyncio.create_task(self._vigilar_lag())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _vigilar_lag(self):
+        while True:
+            inicio = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+            lag_ms = max(0.0, time.monotonic() - inicio - self.intervalo) * 1000
+            # Sube de inmediato y baja a la mitad por medición: un pico aislado no
+            # abre y cierra la puerta en cada ciclo
+            self.lag_ms = max(lag_ms, self.lag_ms / 2)
+            LAG_BUCLE.set(self.lag_ms / 1000)
+
+    @property
+    def sobrecargado(self) -> bool:
+        return self.lag_ms > self.umbral_lag_ms
+
+    def admitir(self, ip: str) -> Optional[str]:
+        """Reserva lugar para una conexión nueva. Devuelve el motivo si se rechaza."""
+        if self.sobrecargado:
+            motivo = "sobrecarga"
+        elif self.conexiones >= self.max_conexiones:
+            motivo = "lleno"
+        elif self._por_ip.get(ip, (0,))[0] >= self.max_por_ip:
+            motivo = "ip"
+        else:
+            self.conexiones += 1
+            entrada = self._por_ip.get(ip)
+            if entrada is None:
+                entrada = self._por_ip[ip] = [0, CubetaTokens(self.tasa_ip, self.rafaga_ip)]
+            entrada[0] += 1
+            return None
+        RECHAZOS.labels(motivo).inc()
+        return motivo
+
+    def liberar(self, ip: str):
+        self.conexiones -= 1
+        entrada = self._por_ip.get(ip)
+        if entrada is not None:
+            entrada[0] -= 1
+            if entrada[0] <= 0:
+                del self._por_ip[ip]
+
+    def cubeta_socket(self) -> CubetaTokens:
+        return CubetaTokens(self.tasa_socket, self.rafaga_socket)
+
+    def permitir(self, ip: str, cubeta: CubetaTokens) -> bool:
+        """Descuenta un mensaje de la cubeta del socket y de la de su IP."""
+        entrada = self._por_ip.get(ip)
+        if cubeta.tomar() and (entrada is None or entrada[1].tomar()):
+            return True
+        RECHAZOS.labels("tasa").inc()
+        return False
+
+    def metricas(self) -> dict:
+        return {
+            "conexiones": self.conexiones,
+            "max_conexiones": self.max_conexiones,
+            "ips": len(self._por_ip),
+            "lag_ms": round(self.lag_ms, 2),
+            "sobrecargado": self.sobrecargado,
+        }
@@ -0,0 +1,256 @@
+# analitica.py
+"""Estadísticas de posiciones con NumPy sobre Movimiento y Partida.
+
+En vez de recorrer filas con el ORM, las jugadas se cargan como columnas
+(partida, turno, posición) y se acumulan con `np.bincount` en matrices
+turno × casilla: cuántas veces se jugó cada casilla en cada turno, cuántas
+de esas veces ganó quien la jugó y cuántas terminaron en empate. Igual para
+las aperturas (primera jugada × respuesta) y el largo de las partidas.
+
+Los acumulados son incrementales: cada actualización lee solo las partidas
+con id mayor a la última cargada, por bloques, así la memoria no crece con
+el histórico. Los resultados armados se guardan hasta el siguiente cambio.
+"""
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import or_, select
+
+from models import Movimiento, Partida
+
+PARTIDAS_POR_BLOQUE = 100000
+
+EMPATE, GANA_X, GANA_O = 0, 1, 2
+
+
+def _tasas(aciertos: np.ndarray, total: np.ndarray) -> list:
+    """aciertos/total redondeado; None donde no hay datos."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tasas = np.round(aciertos / total, 4)
+    return [float(v) if n else None for v, n in zip(tasas.tolist(), total.tolist())]
+
+
+class Analitica:
+    """Acumulados de las partidas de un tamaño de tablero."""
+
+    def __init__(self, tamano: int = 3):
+        self.tamano = tamano
+        self.celdas = c = tamano * tamano
+        self.jugadas = np.zeros((c, c), dtype=np.int64)      # [turno, casilla]
+        self.victorias = np.zeros((c, c), dtype=np.int64)    # ganó quien la jugó
+        self.empates = np.zeros((c, c), dtype=np.int64)
+        self.aperturas = np.zeros((c, c), dtype=np.int64)    # [primera, respuesta]
+        self.aperturas_x = np.zeros((c, c), dtype=np.int64)  # ... y ganó X
+        self.aperturas_empate = np.zeros((c, c), dtype=np.int64)
+        self.primeras = np.zeros((3, c), dtype=np.int64)     # [resultado, primera jugada]
+        self.largos = np.zeros(c + 1, dtype=np.int64)
+        self.sin_jugadas = 0  # partidas sin Movimiento enlazado (p. ej. partida_id NULL)
+        self.resultados = np.zeros(3, dtype=np.int64)        # [empate, gana X, gana O]
+        self.ultimo_id = 0
+        self.actualizado = 0.0
+        self.version = 0
+        self._cache: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    # ======================
+    #   CARGA
+    # ======================
+
+    def _filtro_tamano(self):
+        if self.tamano == 3:
+            # Partidas anteriores a la columna tamano eran todas 3×3
+            return or_(Partida.tamano == 3, Partida.tamano.is_(None))
+        return Partida.tamano == self.tamano
+
+    def cargar(self, db) -> int:
+        """Agrega las partidas nuevas desde la base. Devuelve cuántas se agregaron.
+
+        Las consultas corren sin el lock; solo se toma para sumar cada bloque,
+        así quien lee resultados nunca ve un bloque a medias.
+        """
+        nuevas = 0
+        while True:
+            partidas = db.execute(
+                select(Partida.id, Partida.jugador1_id, Partida.ganador_id)
+                .where(Partida.id > self.ultimo_id, self._filtro_tamano())
+                .order_by(Partida.id)
+                .limit(PARTIDAS_POR_BLOQUE)
+            ).all()
+            if not partidas:
+                break
+            ids = np.fromiter((p[0] for p in partidas), dtype=np.int64, count=len(partidas))
+            jugador1 = np.fromiter((p[1] or 0 for p in partidas), dtype=np.int64, count=len(partidas))
+            ganador = np.fromiter((p[2] or 0 for p in partidas), dtype=np.int64, count=len(partidas))
+            resultado = np.where(ganador == 0, EMPATE, np.where(ganador == jugador1, GANA_X, GANA_O))
+
+            movimientos = db.execute(
+                select(Movimiento.partida_id, Movimiento.turno, Movimiento.posicion)
+                .where(Movimiento.partida_id >= int(ids[0]), Movimiento.partida_id <= int(ids[-1]))
+            ).all()
+            columnas = np.array(movimientos, dtype=np.int64).reshape(-1, 3)
+            with self._lock:
+                self._agregar(ids, resultado, columnas[:, 0], columnas[:, 1], columnas[:, 2])
+                self.ultimo_id = int(ids[-1])
+                self.version += 1
+                self._cache.clear()
+            nuevas += len(ids)
+            if len(partidas) < PARTIDAS_POR_BLOQUE:
+                break
+        self.actualizado = time.monotonic()
+        return nuevas
+
+    def _agregar(self, ids: np.ndarray, resultado: np.ndarray,
+                 partida_id: np.ndarray, turno: np.ndarray, posicion: np.ndarray):
+        c = self.celdas
+        self.resultados += np.bincount(resultado, minlength=3)
+        # Índice de partida de cada jugada; fuera quedan las de partidas de otro tamaño
+        indice = np.searchsorted(ids, partida_id)
+        indice_ok = np.minimum(indice, len(ids) - 1)
+        t = turno - 1
+        validas = (ids[indice_ok] == partida_id) & (t >= 0) & (t < c) & (posicion >= 0) & (posicion < c)
+        g, t, pos = indice_ok[validas], t[validas], posicion[validas]
+        res = resultado[g]
+
+        plano = t * c + pos
+        movedor = np.where(t % 2 == 0, GANA_X, GANA_O)
+        self.jugadas += np.bincount(plano, minlength=c * c).reshape(c, c)
+        self.victorias += np.bincount(plano[res == movedor], minlength=c * c).reshape(c, c)
+        self.empates += np.bincount(plano[res == EMPATE], minlength=c * c).reshape(c, c)
+
+        # Sin jugadas enlazadas no se sabe el largo: van aparte, no como largo 0
+        largos = np.bincount(g, minlength=len(ids))
+        con_jugadas = largos > 0
+        self.largos += np.bincount(np.minimum(largos[con_jugadas], c), minlength=c + 1)
+        self.sin_jugadas += int(len(ids) - np.count_nonzero(con_jugadas))
+
+        primera = np.full(len(ids), -1, dtype=np.int64)
+        segunda = np.full(len(ids), -1, dtype=np.int64)
+        primera[g[t == 0]] = pos[t == 0]
+        segunda[g[t == 1]] = pos[t == 1]
+        con_primera = primera >= 0
+        np.add.at(self.primeras, (resultado[con_primera], primera[con_primera]), 1)
+
+        con_ambas = con_primera & (segunda >= 0)
+        par = primera[con_ambas] * c + segunda[con_ambas]
+        res_par = resultado[con_ambas]
+        self.aperturas += np.bincount(par, minlength=c * c).reshape(c, c)
+        self.aperturas_x += np.bincount(par[res_par == GANA_X], minlength=c * c).reshape(c, c)
+        self.aperturas_empate += np.bincount(par[res_par == EMPATE], minlength=c * c).reshape(c, c)
+
+    # ======================
+    #   RESULTADOS
+    # ======================
+
+    def _cacheado(self, clave: str, construir):
+        with self._lock:
+            if clave not in self._cache:
+                self._cache[clave] = construir()
+            return self._cache[clave]
+
+    @property
+    def partidas(self) -> int:
+        return int(self.resultados.sum())
+
+    def resumen(self) -> dict:
+        def construir():
+            total = self.partidas
+            resultados = self.resultados
+            largos = np.arange(self.celdas + 1)
+            con_largo = int(self.largos.sum())
+            return {
+                "tamano": self.tamano,
+                "partidas": total,
+                "tasa_x": round(float(resultados[GANA_X] / total), 4) if total else None,
+                "tasa_o": round(float(resultados[GANA_O] / total), 4) if total else None,
+                "tasa_empate": round(float(resultados[EMPATE] / total), 4) if total else None,
+                "largo_medio": round(float((largos * self.largos).sum() / con_largo), 3) if con_largo else None,
+                "largos": {int(n): int(k) for n, k in zip(largos, self.largos) if k},
+                "sin_jugadas": self.sin_jugadas,
+            }
+        return self._cacheado("resumen", construir)
+
+    def celdas_por_turno(self) -> dict:
+        def construir():
+            c = self.celdas
+            return {
+                "tamano": self.tamano,
+                "partidas": self.partidas,
+                "turnos": [
+                    {
+                        "turno": t + 1,
+                        "jugadas": self.jugadas[t].tolist(),
+                        "tasa_victoria": _tasas(self.victorias[t], self.jugadas[t]),
+                        "tasa_empate": _tasas(self.empates[t], self.jugadas[t]),
+                    }
+                    for t in range(c) if self.jugadas[t].any()
+                ],
+            }
+        return self._cacheado("celdas", construir)
+
+    def aperturas_comunes(self, limite: int = 10) -> dict:
+        def construir():
+            c = self.celdas
+            por_primera = self.primeras.sum(axis=0)
+            orden = np.argsort(por_primera, kind="stable")[::-1]
+            aperturas = [
+                {
+                    "posicion": int(p),
+                    "partidas": int(por_primera[p]),
+                    "tasa_x": round(float(self.primeras[GANA_X, p] / por_primera[p]), 4),
+                    "tasa_o": round(float(self.primeras[GANA_O, p] / por_primera[p]), 4),
+                    "tasa_empate": round(float(self.primeras[EMPATE, p] / por_primera[p]), 4),
+                }
+                for p in orden[:limite] if por_primera[p]
+            ]
+            planas = self.aperturas.ravel()
+            orden_pares = np.argsort(planas, kind="stable")[::-1]
+            respuestas = [
+                {
+                    "apertura": int(i // c),
+                    "respuesta": int(i % c),
+                    "partidas": int(planas[i]),
+                    "tasa_x": round(float(self.aperturas_x.ravel()[i] / planas[i]), 4),
+                    "tasa_empate": round(float(self.aperturas_empate.ravel()[i] / planas[i]), 4),
+                }
+                for i in orden_pares[:limite] if planas[i]
+            ]
+            return {"tamano": self.tamano, "partidas": self.partidas,
+                    "aperturas": aperturas, "respuestas": respuestas}
+        return self._cacheado(f"aperturas:{limite}", construir)
+
+
+class Analiticas:
+    """Una Analitica por tamaño de tablero, refrescada como mucho cada `refresco_seg`."""
+
+    def __init__(self, session_factory, refresco_seg: float = 5.0):
+        self.session_factory = session_factory
+        self.refresco_seg = refresco_seg
+        self._por_tamano: Dict[int, Analitica] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _cargar(self, analitica: Analitica):
+        db = self.session_factory()
+        try:
+            return analitica.cargar(db)
+        finally:
+            db.close()
+
+    async def obtener(self, tamano: int = 3) -> Analitica:
+        analitica = self._por_tamano.get(tamano)
+        if analitica is None:
+            analitica = self._por_tamano[tamano] = Analitica(tamano)
+            self._locks[tamano] = asyncio.Lock()
+        lock = self._locks[tamano]
+        async with lock:
+            if time.monotonic() - analitica.actualizado >= self.refresco_seg or not analitica.actualizado:
+                await asyncio.to_thread(self._cargar, analitica)
+        return analitica
+
+    def marcar_pendiente(self, tamano: Optional[int] = None):
+        """Fuerza a releer en la próxima consulta (p. ej. al terminar una partida)."""
+        for t, analitica in self._por_tamano.items():
+            if tamano is None or t == tamano:
+                analitica.actualizado = 0.0
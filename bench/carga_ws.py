@@ -0,0 +1,350 @@
+# bench/carga_ws.py
+"""Generador de carga sin interfaz para el servidor de Triki.
+
+Abre muchas salas contra /ws/{partida_id}: dos jugadores que hacen jugadas
+legales al azar y N espectadores por sala. Mide la latencia de cada jugada
+(ida y vuelta hasta que quien movió recibe su jugada, y entrega hasta que la
+recibe el rival), el rendimiento y la memoria del servidor. El reporte es
+JSON con claves ordenadas para poder compararlo entre versiones.
+
+Uso:
+    python bench/carga_ws.py --salas 2000 --concurrencia 500 --espectadores 2 \\
+        --pid $(pgrep -f "uvicorn main:app") --salida reporte.json
+    python bench/carga_ws.py --salas 2000 --comparar reporte_anterior.json
+
+Con miles de sockets simultáneos hay que subir `ulimit -n` en ambos lados.
+
+Todos los sockets salen de una sola IP, así que el servidor debe arrancar
+con los topes por IP de admision.py por encima de la carga: abiertos a la
+vez hay concurrencia × (2 + espectadores) sockets, y cada jugada genera
+unos pocos mensajes entrantes. Para el ejemplo de arriba:
+
+    TRIKI_MAX_CONEXIONES_IP=5000 TRIKI_WS_MENSAJES_IP_SEG=100000 \
+        TRIKI_WS_RAFAGA_IP=100000 uvicorn main:app
+
+Si no, los handshakes rechazados aparecen como error "rechazo_admision".
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+import websockets
+
+VERSION_REPORTE = 1
+
+
+# ======================
+#   MEDICIONES
+# ======================
+
+def percentiles(muestras: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (rango más cercano), media y máximo en milisegundos."""
+    if not muestras:
+        return {"n": 0}
+    orden = sorted(muestras)
+
+    def p(q):
+        return round(orden[min(len(orden) - 1, max(0, int(len(orden) * q + 0.5) - 1))], 3)
+
+    return {
+        "n": len(orden),
+        "p50": p(0.50),
+        "p95": p(0.95),
+        "p99": p(0.99),
+        "max": round(orden[-1], 3),
+        "media": round(sum(orden) / len(orden), 3),
+    }
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Memoria residente del proceso según /proc (solo Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class Resultados:
+    def __init__(self):
+        self.rtt: List[float] = []
+        self.entrega: List[float] = []
+        self.join: List[float] = []
+        self.partidas = 0
+        self.jugadas = 0
+        self.mensajes = 0
+        self.errores: Dict[str, int] = {}
+        self.memoria: List[float] = []
+
+    def error(self, motivo: str):
+        self.errores[motivo] = self.errores.get(motivo, 0) + 1
+
+
+# ======================
+#   CLIENTE SIMULADO
+# ======================
+
+class Cliente:
+    """Un socket de la sala que lleva la cuenta del tablero a partir de los mensajes."""
+
+    def __init__(self, ws, protocolo: int, resultados: Resultados):
+        self.ws = ws
+        self.protocolo = protocolo
+        self.resultados = resultados
+        self.ocupadas = set()
+        self.celdas = 9
+        self.ganador = None
+
+    async def recibir(self) -> dict:
+        mensaje = json.loads(await self.ws.recv())
+        self.resultados.mensajes += 1
+        tipo = mensaje.get("t") or mensaje.get("type")
+        if tipo in ("s", "state", "move_result") and "board" in mensaje:
+            tablero = mensaje["board"]
+            self.celdas = len(tablero)
+            self.ocupadas = {i for i, c in enumerate(tablero) if c and c != "."}
+            self.ganador = mensaje.get("winner")
+        elif tipo == "m":
+            self.ocupadas.add(mensaje["pos"])
+            self.ganador = mensaje.get("winner")
+        return mensaje
+
+    async def esperar_jugada(self, pos: int):
+        """Lee hasta ver aplicada la jugada `pos` (o el fin de la partida)."""
+        while pos not in self.ocupadas and not self.ganador:
+            await self.recibir()
+
+    def jugada_al_azar(self) -> int:
+        return random.choice([i for i in range(self.celdas) if i not in self.ocupadas])
+
+
+async def conectar(url_ws: str, partida_id: str, nombre: Optional[str], protocolo: int,
+                   resultados: Resultados) -> Cliente:
+    inicio = time.perf_counter()
+    ws = await websockets.connect(f"{url_ws}/ws/{partida_id}", max_size=None)
+    cliente = Cliente(ws, protocolo, resultados)
+    await ws.send(json.dumps({"action": "join", "name": nombre, "protocol": protocolo}))
+    # Primero llega el "info" con el asiento; luego la foto del tablero
+    while True:
+        mensaje = await cliente.recibir()
+        if mensaje.get("type") == "info":
+            break
+    resultados.join.append((time.perf_counter() - inicio) * 1000)
+    return cliente
+
+
+def rechazo_admision(e: Exception) -> bool:
+    """Handshake rechazado por el control de admisión (cierre antes de aceptar: HTTP 403)."""
+    estado = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return estado == 403
+
+
+async def drenar(cliente: Cliente):
+    """Espectador: solo consume mensajes hasta que se cierre el socket."""
+    try:
+        while True:
+            await cliente.recibir()
+    except (websockets.ConnectionClosed, asyncio.CancelledError):
+        pass
+
+
+async def jugar_sala(args, indice: int, resultados: Resultados):
+    try:
+        respuesta = await asyncio.to_thread(
+            requests.post, f"{args.url}/api/create_partida",
+            params={"tamano": args.tamano, "en_linea": args.en_linea}, timeout=30,
+        )
+        respuesta.raise_for_status()
+        partida_id = respuesta.json()["partida_id"]
+    except Exception:
+        resultados.error("crear_partida")
+        return
+
+    url_ws = "ws" + args.url[len("http"):]
+    clientes: List[Cliente] = []
+    espectadores: List[asyncio.Task] = []
+    try:
+        # En orden: el primero queda con X y el segundo con O
+        x = await conectar(url_ws, partida_id, f"{args.prefijo}-{indice}-x", args.protocolo, resultados)
+        clientes.append(x)
+        o = await conectar(url_ws, partida_id, f"{args.prefijo}-{indice}-o", args.protocolo, resultados)
+        clientes.append(o)
+        for e in range(args.espectadores):
+            espectador = await conectar(url_ws, partida_id, f"{args.prefijo}-{indice}-e{e}",
+                                        args.protocolo, resultados)
+            clientes.append(espectador)
+            espectadores.append(asyncio.create_task(drenar(espectador)))
+
+        for _ in range(args.partidas_por_sala):
+            turno, rival = x, o
+            while not turno.ganador:
+                pos = turno.jugada_al_azar()
+                inicio = time.perf_counter()
+                await turno.ws.send(json.dumps({"action": "move", "position": pos}))
+                await asyncio.wait_for(turno.esperar_jugada(pos), args.timeout)
+                resultados.rtt.append((time.perf_counter() - inicio) * 1000)
+                await asyncio.wait_for(rival.esperar_jugada(pos), args.timeout)
+                resultados.entrega.append((time.perf_counter() - inicio) * 1000)
+                resultados.jugadas += 1
+                turno, rival = rival, turno
+            resultados.partidas += 1
+
+            if args.partidas_por_sala > 1:
+                await x.ws.send(json.dumps({"action": "reset"}))
+                for cliente in (x, o):
+                    while cliente.ganador or cliente.ocupadas:
+                        await asyncio.wait_for(cliente.recibir(), args.timeout)
+    except asyncio.TimeoutError:
+        resultados.error("timeout")
+    except websockets.ConnectionClosed:
+        resultados.error("conexion_cerrada")
+    except Exception as e:
+        resultados.error("rechazo_admision" if rechazo_admision(e) else type(e).__name__)
+    finally:
+        for tarea in espectadores:
+            tarea.cancel()
+        for cliente in clientes:
+            try:
+                await cliente.ws.close()
+            except Exception:
+                pass
+
+
+async def muestrear_memoria(pid: int, resultados: Resultados, intervalo: float = 0.5):
+    while True:
+        valor = rss_mb(pid)
+        if valor is not None:
+            resultados.memoria.append(valor)
+        await asyncio.sleep(intervalo)
+
+
+# ======================
+#   REPORTE
+# ======================
+
+async def ejecutar(args) -> dict:
+    resultados = Resultados()
+    muestreo = asyncio.create_task(muestrear_memoria(args.pid, resultados)) if args.pid else None
+    limite = asyncio.Semaphore(args.concurrencia)
+
+    async def con_limite(i):
+        async with limite:
+            await jugar_sala(args, i, resultados)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(con_limite(i) for i in range(args.salas)))
+    duracion = time.perf_counter() - inicio
+    if muestreo:
+        muestreo.cancel()
+        valor = rss_mb(args.pid)
+        if valor is not None:
+            resultados.memoria.append(valor)
+
+    memoria = None
+    if resultados.memoria:
+        memoria = {
+            "inicio": round(resultados.memoria[0], 1),
+            "pico": round(max(resultados.memoria), 1),
+            "fin": round(resultados.memoria[-1], 1),
+        }
+    return {
+        "version_reporte": VERSION_REPORTE,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "url": args.url,
+            "salas": args.salas,
+            "concurrencia": args.concurrencia,
+            "espectadores": args.espectadores,
+            "partidas_por_sala": args.partidas_por_sala,
+            "protocolo": args.protocolo,
+            "tamano": args.tamano,
+            "en_linea": args.en_linea,
+        },
+        "duracion_seg": round(duracion, 3),
+        "partidas": resultados.partidas,
+        "jugadas": resultados.jugadas,
+        "jugadas_por_seg": round(resultados.jugadas / duracion, 1) if duracion else 0,
+        "mensajes_recibidos": resultados.mensajes,
+        "mensajes_por_seg": round(resultados.mensajes / duracion, 1) if duracion else 0,
+        "errores": resultados.errores,
+        "latencia_ms": {
+            "join": percentiles(resultados.join),
+            "rtt_jugada": percentiles(resultados.rtt),
+            "entrega_rival": percentiles(resultados.entrega),
+        },
+        "memoria_servidor_mb": memoria,
+    }
+
+
+def _aplanar(reporte: dict, prefijo: str = "") -> Dict[str, float]:
+    planas = {}
+    for clave, valor in reporte.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planas.update(_aplanar(valor, nombre + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planas[nombre] = valor
+    return planas
+
+
+def comparar(base: dict, actual: dict) -> str:
+    """Tabla con las métricas numéricas de ambos reportes y su variación."""
+    a, b = _aplanar(base), _aplanar(actual)
+    lineas = [f"{'métrica':<36}{'base':>12}{'actual':>12}{'cambio':>10}"]
+    for clave in sorted(a.keys() | b.keys()):
+        if clave.startswith(("config.", "version_reporte")):
+            continue
+        va, vb = a.get(clave), b.get(clave)
+        cambio = ""
+        if va and vb is not None:
+            cambio = f"{(vb - va) / va * 100:+.1f}%"
+        lineas.append(f"{clave:<36}{va if va is not None else '-':>12}{vb if vb is not None else '-':>12}{cambio:>10}")
+    return "\n".join(lineas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--salas", type=int, default=100, help="salas a jugar en total")
+    parser.add_argument("--concurrencia", type=int, default=100, help="salas jugando a la vez")
+    parser.add_argument("--espectadores", type=int, default=0, help="espectadores por sala")
+    parser.add_argument("--partidas-por-sala", type=int, default=1)
+    parser.add_argument("--protocolo", type=int, choices=(1, 2), default=2)
+    parser.add_argument("--tamano", type=int, default=3)
+    parser.add_argument("--en-linea", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=10.0, help="segundos de espera por jugada")
+    parser.add_argument("--prefijo", default="bench", help="prefijo de los nombres de jugador")
+    parser.add_argument("--pid", type=int, help="PID del servidor para medir su memoria")
+    parser.add_argument("--salida", help="archivo donde guardar el reporte JSON")
+    parser.add_argument("--comparar", help="reporte anterior contra el cual comparar")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip("/")
+
+    reporte = asyncio.run(ejecutar(args))
+    texto = json.dumps(reporte, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    print(texto)
+    if reporte["errores"].get("rechazo_admision"):
+        print("aviso: el servidor rechazó conexiones; sube TRIKI_MAX_CONEXIONES_IP y "
+              "TRIKI_WS_MENSAJES_IP_SEG (ver la ayuda de este script)", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            print()
+            print(comparar(json.load(f), reporte))
+    return 1 if reporte["errores"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# bench/micro.py
+"""Micro-benchmarks de los caminos calientes, con línea base y umbral de regresión.
+
+Casos:
+    lógica       TrikiGame.make_move (partida completa), check_winner sobre
+                 tableros 3×3 y 15×15, jugada del solver
+    serializar   protocolo.codificar de jugadas y fotos en v1, v2 JSON y binario
+    jugadores    CacheJugadores.get (acierto) frente a buscar el id por nombre
+    sql          consultas de /api/historico (primera página, con cursor, por
+                 jugador) y la carga de la clasificación de /api/estadisticas,
+                 sobre SQLite sembradas con 10k/100k/1M partidas
+
+Las bases sembradas se guardan en bench/datos/ y se reutilizan entre
+corridas. Las consultas se miden con el engine síncrono: lo que interesa es
+el plan de SQLite, no el costo de aiosqlite.
+
+Uso:
+    python bench/micro.py --guardar-baseline           # fija la línea base
+    python bench/micro.py                              # compara; sale con 1 si algo empeoró
+                                                       # y con 2 si falta la línea base
+    python bench/micro.py --filas 10000 --umbral 0.25 --solo logica,serializar
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATOS = os.path.join(RAIZ, "bench", "datos")
+BASELINE = os.path.join(RAIZ, "bench", "baseline_micro.json")
+sys.path.insert(0, RAIZ)
+os.chdir(RAIZ)  # main.py monta static/ con ruta relativa
+
+# main.py crea tablas al importarse: que lo haga en una base de prueba
+os.makedirs(DATOS, exist_ok=True)
+os.environ.setdefault("TRIKI_DATABASE_URL", f"sqlite:///{os.path.join(DATOS, 'importacion.db')}")
+os.environ.setdefault("TRIKI_GAME_STORE", "memoria")
+
+from sqlalchemy import and_, create_engine, insert, or_, select  # noqa: E402
+
+import main  # noqa: E402
+import protocolo  # noqa: E402
+import solver  # noqa: E402
+from database import Base  # noqa: E402
+from game_logic import TrikiGame, bits_to_board  # noqa: E402
+from identidades import CacheJugadores  # noqa: E402
+from leaderboard import Clasificacion, calcular_puntaje  # noqa: E402
+from models import Jugador, Movimiento, Partida  # noqa: E402
+
+JUGADORES_SEMBRADOS = 1000
+FILAS_POR_LOTE = 50000
+
+
+# ======================
+#   MEDICIÓN
+# ======================
+
+def medir(fn: Callable[[], object], repeticiones: int = 5) -> float:
+    """Microsegundos por llamada: el mínimo de varias rondas de timeit."""
+    timer = timeit.Timer(fn)
+    numero, _ = timer.autorange()
+    return min(timer.repeat(repeticiones, numero)) / numero * 1e6
+
+
+# ======================
+#   CASOS SIN BASE DE DATOS
+# ======================
+
+def _partida_completa():
+    juego = TrikiGame()
+    for pos in (4, 0, 2, 6, 3, 5, 1, 7, 8):
+        juego.make_move(pos)
+    return juego
+
+
+def casos_logica() -> Dict[str, Callable]:
+    rng = random.Random(7)
+    tableros = []
+    for _ in range(256):
+        juego = TrikiGame()
+        while not juego.winner:
+            libres = [i for i in range(9) if juego.is_legal(i)]
+            juego.make_move(rng.choice(libres))
+        tableros.append(juego.get_board_state())
+    grande = TrikiGame(15, 5)
+    for pos in rng.sample(range(225), 60):
+        grande.make_move(pos)
+    tablero_grande = grande.get_board_state()
+    iterador = itertools.cycle(tableros)
+
+    solver.precalcular()
+    juego_cpu = TrikiGame()
+    juego_cpu.make_move(4)
+
+    return {
+        "logica.make_move_partida": _partida_completa,
+        "logica.check_winner_3x3": lambda: main.check_winner(next(iterador)),
+        "logica.check_winner_15x15": lambda: main.check_winner(tablero_grande, 5),
+        "logica.solver_jugada": lambda: solver.jugada_para(juego_cpu),
+    }
+
+
+def casos_serializar() -> Dict[str, Callable]:
+    juego = _partida_completa()
+    jugada = {"type": "move_result", "seq": 9, "size": 3, "x": juego.x_bits, "o": juego.o_bits,
+              "pos": 8, "sym": "X", "turn": juego.current_player, "winner": juego.winner}
+    foto = {"type": "state", "seq": 9, "size": 3, "win_length": 3, "x": juego.x_bits,
+            "o": juego.o_bits, "turn": juego.current_player, "winner": juego.winner}
+    return {
+        "serializar.jugada_v1": lambda: protocolo.codificar(jugada, 1),
+        "serializar.jugada_v2_json": lambda: protocolo.codificar(jugada, 2),
+        "serializar.jugada_v2_binario": lambda: protocolo.codificar(jugada, 2, True),
+        "serializar.foto_v1": lambda: protocolo.codificar(foto, 1),
+        "serializar.foto_v2_binario": lambda: protocolo.codificar(foto, 2, True),
+        "serializar.tablero_desde_bits": lambda: bits_to_board(juego.x_bits, juego.o_bits),
+    }
+
+
+# ======================
+#   BASES SEMBRADAS
+# ======================
+
+def sembrar(ruta: str, partidas: int):
+    """Crea `ruta` con JUGADORES_SEMBRADOS jugadores y `partidas` partidas con sus jugadas."""
+    engine = create_engine(f"sqlite:///{ruta}")
+    Base.metadata.create_all(engine)
+    rng = random.Random(partidas)
+    inicio = datetime(2024, 1, 1)
+    ganadas = [0] * (JUGADORES_SEMBRADOS + 1)
+    perdidas = [0] * (JUGADORES_SEMBRADOS + 1)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        for desde in range(0, partidas, FILAS_POR_LOTE):
+            filas_partida, filas_mov = [], []
+            for pid in range(desde + 1, min(desde + FILAS_POR_LOTE, partidas) + 1):
+                j1, j2 = rng.sample(range(1, JUGADORES_SEMBRADOS + 1), 2)
+                juego = TrikiGame()
+                fecha = inicio + timedelta(seconds=pid * 30)
+                turno = 0
+                while not juego.winner:
+                    libres = [i for i in range(9) if juego.is_legal(i)]
+                    pos = rng.choice(libres)
+                    turno += 1
+                    filas_mov.append({"partida_id": pid, "jugador_id": j1 if turno % 2 else j2,
+                                      "posicion": pos, "turno": turno,
+                                      "timestamp": fecha + timedelta(seconds=turno)})
+                    juego.make_move(pos)
+                ganador = {"X": j1, "O": j2}.get(juego.winner)
+                if ganador:
+                    ganadas[ganador] += 1
+                    perdidas[j2 if ganador == j1 else j1] += 1
+                filas_partida.append({"id": pid, "jugador1_id": j1, "jugador2_id": j2,
+                                      "ganador_id": ganador, "fecha": fecha, "duracion_seg": turno,
+                                      "codigo": f"{pid:08x}", "tamano": 3, "en_linea": 3})
+            conn.execute(insert(Partida), filas_partida)
+            conn.execute(insert(Movimiento), filas_mov)
+        conn.execute(insert(Jugador), [
+            {"id": i, "nombre": f"jugador{i}", "ganadas": ganadas[i], "perdidas": perdidas[i],
+             "puntaje": calcular_puntaje(ganadas[i], perdidas[i])}
+            for i in range(1, JUGADORES_SEMBRADOS + 1)
+        ])
+    engine.dispose()
+
+
+def base_sembrada(partidas: int) -> str:
+    ruta = os.path.join(DATOS, f"triki_{partidas}.db")
+    if not os.path.exists(ruta):
+        print(f"sembrando {ruta} ...", file=sys.stderr)
+        inicio = time.perf_counter()
+        sembrar(ruta + ".tmp", partidas)
+        os.replace(ruta + ".tmp", ruta)
+        print(f"  {time.perf_counter() - inicio:.1f} s", file=sys.stderr)
+    return ruta
+
+
+def casos_sql(partidas: int) -> Dict[str, Callable]:
+    ruta = base_sembrada(partidas)
+    engine = create_engine(f"sqlite:///file:{ruta}?mode=ro&uri=true")
+    conn = engine.connect()
+    orden = (Partida.fecha.desc(), Partida.id.desc())
+    mitad = conn.execute(select(Partida.fecha, Partida.id).where(Partida.id == partidas // 2)).one()
+    cursor = main.consulta_historico().where(or_(
+        Partida.fecha < mitad[0],
+        and_(Partida.fecha == mitad[0], Partida.id < mitad[1])
+    ))
+    sufijo = f"@{partidas}"
+
+    def clasificacion():
+        c = Clasificacion()
+        c.cargar(conn.execute(select(Jugador.nombre, Jugador.ganadas, Jugador.perdidas)))
+        return c.top(10)
+
+    cache = CacheJugadores(None)
+    for i in range(1, JUGADORES_SEMBRADOS + 1):
+        cache._guardar(f"jugador{i}", i)
+    nombres = itertools.cycle([f"jugador{i}" for i in range(1, JUGADORES_SEMBRADOS + 1)])
+
+    return {
+        f"sql.historico_primera_pagina{sufijo}":
+            lambda: conn.execute(main.consulta_historico().order_by(*orden).limit(51)).all(),
+        f"sql.historico_con_cursor{sufijo}":
+            lambda: conn.execute(cursor.order_by(*orden).limit(51)).all(),
+        f"sql.historico_por_jugador{sufijo}":
+            lambda: conn.execute(main.consulta_historico("jugador7").order_by(*orden).limit(51)).all(),
+        f"sql.cargar_clasificacion{sufijo}": clasificacion,
+        f"jugadores.id_por_nombre_sql{sufijo}":
+            lambda: conn.execute(select(Jugador.id).where(Jugador.nombre == next(nombres))).scalar(),
+        f"jugadores.id_por_nombre_cache{sufijo}": lambda: cache.get(next(nombres)),
+    }
+
+
+# ======================
+#   LÍNEA BASE
+# ======================
+
+def comparar(resultados: Dict[str, float], base: Dict[str, float], umbral: float) -> Tuple[List[str], List[str]]:
+    """Imprime la comparación. Devuelve (casos que superan la base por más de
+    `umbral`, casos sin valor en la base)."""
+    regresiones, sin_base = [], []
+    print(f"\n{'caso':<48}{'base µs':>12}{'actual µs':>12}{'cambio':>10}")
+    for caso, actual in resultados.items():
+        anterior = base.get(caso)
+        if anterior is None:
+            print(f"{caso:<48}{'-':>12}{actual:>12.2f}{'nuevo':>10}")
+            sin_base.append(caso)
+            continue
+        cambio = (actual - anterior) / anterior
+        marca = "  <-- regresión" if cambio > umbral else ""
+        print(f"{caso:<48}{anterior:>12.2f}{actual:>12.2f}{cambio:>+10.1%}{marca}")
+        if cambio > umbral:
+            regresiones.append(caso)
+    return regresiones, sin_base
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filas", default="10000,100000,1000000",
+                        help="tamaños de las bases sembradas (partidas), separados por coma")
+    parser.add_argument("--solo", help="grupos a correr: logica,serializar,sql")
+    parser.add_argument("--umbral", type=float, default=0.20,
+                        help="empeoramiento relativo tolerado antes de fallar (0.20 = 20%%)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--guardar-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Sin línea base no hay contra qué comparar: se falla antes de medir
+    if not args.guardar_baseline and not os.path.exists(args.baseline):
+        print(f"falta la línea base {args.baseline}; fijarla con --guardar-baseline en la máquina de referencia")
+        return 2
+
+    grupos = set((args.solo or "logica,serializar,sql").split(","))
+    casos: Dict[str, Callable] = {}
+    if "logica" in grupos:
+        casos.update(casos_logica())
+    if "serializar" in grupos:
+        casos.update(casos_serializar())
+    if "sql" in grupos:
+        for partidas in (int(f) for f in args.filas.split(",") if f):
+            casos.update(casos_sql(partidas))
+
+    resultados = {}
+    for caso, fn in casos.items():
+        resultados[caso] = round(medir(fn), 3)
+        print(f"{caso:<48}{resultados[caso]:>12.2f} µs")
+
+    if args.guardar_baseline:
+        base = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                base = json.load(f)
+        base.update(resultados)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(base, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nlínea base guardada en {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        regresiones, sin_base = comparar(resultados, json.load(f), args.umbral)
+    if regresiones:
+        print(f"\n{len(regresiones)} caso(s) más de {args.umbral:.0%} por encima de la línea base")
+        return 1
+    if sin_base:
+        print(f"\n{len(sin_base)} caso(s) sin línea base; agregarlos con --guardar-baseline")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,17 +1,109 @@
 # database.py
-from sqlalchemy import create_engine
+"""Conexión a la base de datos.
+
+Hay dos engines: uno de escritura con una sola conexión (SQLite admite un
+escritor a la vez, así se evita pelear por el lock) y un pool de conexiones
+de solo lectura para los endpoints de estadísticas e histórico. En modo WAL
+los lectores no bloquean al escritor ni al revés.
+
+Cada uno tiene su versión asíncrona (SQLAlchemy asyncio sobre aiosqlite)
+para usar desde el event loop sin bloquearlo: la cola de persistencia
+escribe por `SessionAsync` y los endpoints async leen por
+`SessionAsyncLectura`.
+
+Con el servidor corriendo, el único que escribe es `engine_async`. El
+`engine` síncrono se usa solo al arrancar (create_all, migraciones), antes
+de que la cola de persistencia empiece, y en herramientas fuera de línea
+como selfplay.py, que conviene correr con el servidor detenido. El
+`engine_lectura` síncrono queda para las exportaciones en streaming.
+
+Configuración por variables de entorno:
+    TRIKI_DATABASE_URL        sqlite:///./triki.db
+    TRIKI_SQLITE_WAL          1 (journal_mode=WAL)
+    TRIKI_SQLITE_SYNCHRONOUS  NORMAL
+    TRIKI_SQLITE_MMAP_MB      256
+    TRIKI_SQLITE_CACHE_MB     64
+    TRIKI_SQLITE_BUSY_MS      5000
+    TRIKI_DB_POOL_LECTURA     8
+"""
+import os
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DATABASE_URL = os.environ.get("TRIKI_DATABASE_URL", "sqlite:///./triki.db")
+ES_SQLITE = DATABASE_URL.startswith("sqlite:///")
+
+SQLITE_WAL = os.environ.get("TRIKI_SQLITE_WAL", "1") == "1"
+SQLITE_SYNCHRONOUS = os.environ.get("TRIKI_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_MB = int(os.environ.get("TRIKI_SQLITE_MMAP_MB", 256))
+SQLITE_CACHE_MB = int(os.environ.get("TRIKI_SQLITE_CACHE_MB", 64))
+SQLITE_BUSY_MS = int(os.environ.get("TRIKI_SQLITE_BUSY_MS", 5000))
+POOL_LECTURA = int(os.environ.get("TRIKI_DB_POOL_LECTURA", 8))
+
+
+def _aplicar_pragmas(engine, escritura: bool):
+    @event.listens_for(engine, "connect")
+    def pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        if escritura:
+            # journal_mode queda guardado en el archivo; solo lo fija el escritor
+            if SQLITE_WAL:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        else:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        # cache_size negativo = tamaño en KiB
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+if ES_SQLITE:
+    # Crear engine de escritura: una sola conexión reutilizada
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=30,
+    )
+    _aplicar_pragmas(engine, escritura=True)
 
-DATABASE_URL = "sqlite:///./triki.db"
+    ruta = DATABASE_URL[len("sqlite:///"):]
+    engine_lectura = create_engine(
+        f"sqlite:///file:{ruta}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=POOL_LECTURA, max_overflow=POOL_LECTURA,
+    )
+    _aplicar_pragmas(engine_lectura, escritura=False)
 
-# Crear engine
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+    engine_async = create_async_engine(
+        f"sqlite+aiosqlite:///{ruta}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=30,
+    )
+    _aplicar_pragmas(engine_async.sync_engine, escritura=True)
+    engine_async_lectura = create_async_engine(
+        f"sqlite+aiosqlite:///file:{ruta}?mode=ro&uri=true",
+        poolclass=AsyncAdaptedQueuePool, pool_size=POOL_LECTURA, max_overflow=POOL_LECTURA,
+    )
+    _aplicar_pragmas(engine_async_lectura.sync_engine, escritura=False)
+else:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    engine_lectura = engine
+    # La URL debe tener driver async equivalente (p. ej. postgresql+asyncpg)
+    engine_async = engine_async_lectura = create_async_engine(
+        os.environ.get("TRIKI_DATABASE_URL_ASYNC", DATABASE_URL), pool_pre_ping=True
+    )
 
-# Sesión local
+# Sesión local (escritura) y de solo lectura
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLectura = sessionmaker(autocommit=False, autoflush=False, bind=engine_lectura)
+SessionAsync = sessionmaker(bind=engine_async, class_=AsyncSession, expire_on_commit=False)
+SessionAsyncLectura = sessionmaker(bind=engine_async_lectura, class_=AsyncSession, expire_on_commit=False)
 
 # Base para heredar modelos
 Base = declarative_base()
@@ -23,4 +115,38 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_db_lectura():
+    """Sesión de solo lectura para endpoints que no escriben."""
+    db = SessionLectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db_lectura():
+    """Sesión async de solo lectura para endpoints `async def`."""
+    async with SessionAsyncLectura() as db:
+        yield db
+
+
+def agregar_columnas_faltantes(bind):
+    """Agrega a las tablas existentes las columnas nuevas de los modelos.
+
+    create_all solo crea tablas que no existen; esto cubre columnas nulables
+    añadidas después (SQLite permite ADD COLUMN sin reescribir la tabla).
+    """
+    with bind.begin() as conn:
+        # El inspector usa la misma conexión: el pool de escritura tiene solo una
+        inspector = inspect(conn)
+        for tabla in Base.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}"))
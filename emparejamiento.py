@@ -0,0 +1,164 @@
+# emparejamiento.py
+"""Cola de emparejamiento automático por bandas de puntaje.
+
+Cada jugador que espera cae en la banda `puntaje // ancho_banda`; cada banda
+es un OrderedDict en orden de llegada, así encolar, cancelar y sacar a los
+dos primeros cuestan O(1). Una tarea empareja en lotes cada `intervalo_ms`:
+primero dentro de cada banda y después, con quienes ya esperaron más de
+`ampliar_tras_seg`, entre bandas vecinas (el que queda solo en su banda no
+espera para siempre).
+
+La cola vive en el proceso: con varios workers, /ws/matchmaking debe ir
+siempre al mismo (o se empareja solo entre quienes cayeron en cada uno).
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metricas import Contador, Histograma, Medidor
+
+logger = logging.getLogger(__name__)
+
+ESPERA_SEGUNDOS = Histograma(
+    "triki_emparejamiento_espera_segundos", "Tiempo en cola hasta recibir rival",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+EN_COLA = Medidor("triki_emparejamiento_en_cola", "Jugadores esperando rival")
+PAREJAS = Contador("triki_emparejamiento_parejas_total", "Parejas formadas", ["tipo"])
+CANCELADOS = Contador("triki_emparejamiento_cancelados_total", "Jugadores que dejaron la cola")
+
+# crear_sala(nombre_x, nombre_o) -> (partida_id, {nombre: token para reclamar el asiento})
+CrearSala = Callable[[str, str], Awaitable[Tuple[str, Dict[str, str]]]]
+
+
+class Espera:
+    __slots__ = ("ticket", "nombre", "puntaje", "banda", "desde", "futuro")
+
+    def __init__(self, ticket: int, nombre: str, puntaje: int, banda: int):
+        self.ticket = ticket
+        self.nombre = nombre
+        self.puntaje = puntaje
+        self.banda = banda
+        self.desde = time.monotonic()
+        # Se resuelve con {"partida_id", "rival", "symbol", "token"}
+        self.futuro: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class ColaEmparejamiento:
+    def __init__(self, crear_sala: CrearSala, ancho_banda: int = 10, intervalo_ms: int = 100,
+                 ampliar_tras_seg: float = 5.0):
+        self.crear_sala = crear_sala
+        self.ancho_banda = ancho_banda
+        self.intervalo = intervalo_ms / 1000
+        self.ampliar_tras_seg = ampliar_tras_seg
+        self._bandas: Dict[int, "OrderedDict[int, Espera]"] = {}
+        self._por_nombre: Dict[str, Espera] = {}
+        self._tickets = itertools.count(1)
+        self._tarea: Optional[asyncio.Task] = None
+        self._parejas = 0
+        self._espera_total = 0.0
+
+    async def iniciar(self):
+        self._tarea = asyncio.create_task(self._emparejar_periodicamente())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+        for espera in list(self._por_nombre.values()):
+            self.cancelar(espera)
+
+    def encolar(self, nombre: str, puntaje: int) -> Espera:
+        """Agrega al jugador; si ya esperaba con otro socket, reemplaza esa espera."""
+        anterior = self._por_nombre.get(nombre)
+        if anterior is not None:
+            self.cancelar(anterior)
+        espera = Espera(next(self._tickets), nombre, puntaje, puntaje // self.ancho_banda)
+        self._bandas.setdefault(espera.banda, OrderedDict())[espera.ticket] = espera
+        self._por_nombre[nombre] = espera
+        EN_COLA.inc()
+        return espera
+
+    def cancelar(self, espera: Espera):
+        if self._quitar(espera):
+            CANCELADOS.inc()
+        if not espera.futuro.done():
+            espera.futuro.cancel()
+
+    def _quitar(self, espera: Espera) -> bool:
+        banda = self._bandas.get(espera.banda)
+        if banda is None or banda.pop(espera.ticket, None) is None:
+            return False
+        if not banda:
+            del self._bandas[espera.banda]
+        if self._por_nombre.get(espera.nombre) is espera:
+            del self._por_nombre[espera.nombre]
+        EN_COLA.dec()
+        return True
+
+    def _formar_parejas(self) -> List[tuple]:
+        parejas = []
+        # Dentro de cada banda, por orden de llegada
+        for banda in list(self._bandas.values()):
+            while len(banda) >= 2:
+                a = banda[next(iter(banda))]
+                self._quitar(a)
+                b = banda[next(iter(banda))]
+                self._quitar(b)
+                parejas.append((a, b, "banda"))
+
+        # Quedan a lo sumo uno por banda: se juntan vecinos que ya esperaron bastante
+        limite = time.monotonic() - self.ampliar_tras_seg
+        solos = sorted(
+            (e for banda in self._bandas.values() for e in banda.values() if e.desde <= limite),
+            key=lambda e: e.banda,
+        )
+        for a, b in zip(solos[::2], solos[1::2]):
+            self._quitar(a)
+            self._quitar(b)
+            parejas.append((a, b, "ampliada"))
+        return parejas
+
+    async def emparejar(self):
+        """Forma todas las parejas posibles ahora y les crea sala."""
+        for a, b, tipo in self._formar_parejas():
+            # El que más esperó juega con X
+            if b.desde < a.desde:
+                a, b = b, a
+            try:
+                partida_id, tokens = await self.crear_sala(a.nombre, b.nombre)
+            except Exception:
+                logger.exception("No se pudo crear la sala para %s y %s", a.nombre, b.nombre)
+                for espera in (a, b):
+                    if not espera.futuro.done():
+                        espera.futuro.set_exception(RuntimeError("No se pudo crear la sala"))
+                continue
+            ahora = time.monotonic()
+            PAREJAS.labels(tipo).inc()
+            self._parejas += 1
+            for espera, rival, simbolo in ((a, b, "X"), (b, a, "O")):
+                ESPERA_SEGUNDOS.observe(ahora - espera.desde)
+                self._espera_total += ahora - espera.desde
+                if not espera.futuro.done():
+                    espera.futuro.set_result({"partida_id": partida_id, "rival": rival.nombre,
+                                              "symbol": simbolo, "token": tokens.get(espera.nombre)})
+
+    async def _emparejar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.emparejar()
+            except Exception:
+                logger.exception("Error en el ciclo de emparejamiento")
+
+    def metricas(self) -> dict:
+        return {
+            "en_cola": len(self._por_nombre),
+            "bandas": {banda * self.ancho_banda: len(e) for banda, e in sorted(self._bandas.items())},
+            "parejas": self._parejas,
+            "espera_media_seg": round(self._espera_total / (2 * self._parejas), 3) if self._parejas else 0.0,
+            "intervalo_ms": self.intervalo * 1000,
+            "ancho_banda": self.ancho_banda,
+        }
@@ -0,0 +1,92 @@
+# eventlog.py
+"""Bitácora de eventos por sala (event sourcing).
+
+Cada cambio de una sala se registra como evento numerado (create, join,
+leave, move, reset, finish) y cada SNAPSHOT_CADA eventos se guarda además
+una foto completa. Para reconstruir la sala en cualquier punto basta con
+cargar la última foto anterior y aplicar los eventos que siguen, así el
+costo del replay queda acotado.
+"""
+import json
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from game_logic import TrikiGame
+from models import EventoPartida, SnapshotPartida
+from store import Sala
+
+SNAPSHOT_CADA = 20
+
+
+def registrar(sala: Sala, tipo: str, datos: dict) -> List[dict]:
+    """Numera un evento ya aplicado a `sala` y devuelve lo que hay que persistir.
+
+    Se serializa aquí mismo porque la sala puede seguir cambiando antes de
+    que la cola de persistencia escriba el lote.
+    """
+    sala.eventos += 1
+    pendientes = [{"num": sala.eventos, "tipo": tipo, "datos": json.dumps(datos)}]
+    if sala.eventos % SNAPSHOT_CADA == 0:
+        pendientes.append({"num": sala.eventos, "tipo": "snapshot", "estado": json.dumps(sala.to_dict(sesiones=False))})
+    return pendientes
+
+
+def aplicar(sala: Sala, tipo: str, datos: dict):
+    """Aplica un evento de la bitácora sobre la sala (usado en el replay)."""
+    if tipo == "create":
+        sala.juego = TrikiGame(datos["tamano"], datos["en_linea"])
+        sala.asientos = {}
+        sala.jugadas = []
+        sala.cpu = None
+    elif tipo == "join":
+        sala.asientos[datos["nombre"]] = datos["simbolo"]
+        if datos.get("cpu"):
+            sala.cpu = datos["simbolo"]
+    elif tipo == "leave":
+        sala.asientos.pop(datos["nombre"], None)
+    elif tipo == "move":
+        sala.juego.make_move(datos["pos"])
+        sala.jugadas.append([datos["nombre"], datos["pos"], datos.get("ts", time.time())])
+        sala.seq += 1
+    elif tipo == "reset":
+        sala.juego.reset()
+        sala.jugadas = []
+        sala.seq += 1
+    # "finish" es informativo: el ganador ya se deduce de las jugadas
+
+
+def reconstruir(db: Session, codigo: str, hasta: Optional[int] = None) -> Optional[Sala]:
+    """Estado de la sala tras el evento `hasta` (o el último). None si no hay bitácora."""
+    snapshots = db.query(SnapshotPartida).filter(SnapshotPartida.codigo == codigo)
+    eventos = db.query(EventoPartida).filter(EventoPartida.codigo == codigo)
+    if hasta is not None:
+        snapshots = snapshots.filter(SnapshotPartida.num <= hasta)
+        eventos = eventos.filter(EventoPartida.num <= hasta)
+
+    snapshot = snapshots.order_by(SnapshotPartida.num.desc()).first()
+    if snapshot:
+        sala = Sala.from_dict(json.loads(snapshot.estado))
+        eventos = eventos.filter(EventoPartida.num > snapshot.num)
+    else:
+        sala = None
+
+    for evento in eventos.order_by(EventoPartida.num):
+        if sala is None:
+            sala = Sala()
+        aplicar(sala, evento.tipo, json.loads(evento.datos))
+        sala.eventos = evento.num
+    return sala
+
+
+def codigos_activos(db: Session, desde: datetime) -> List[str]:
+    """Salas con eventos posteriores a `desde` (candidatas a recuperar)."""
+    filas = (
+        db.query(EventoPartida.codigo)
+        .group_by(EventoPartida.codigo)
+        .having(func.max(EventoPartida.timestamp) >= desde)
+    )
+    return [codigo for codigo, in filas]
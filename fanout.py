@@ -0,0 +1,83 @@
+# fanout.py
+"""Envío no bloqueante a los WebSockets.
+
+Cada conexión tiene una cola acotada de mensajes ya serializados y una tarea
+propia que la vacía, así un espectador lento no frena al resto de la sala ni
+el bucle de lectura de quien movió. Si la cola se llena se aplica la
+política configurada: descartar el mensaje o desconectar al cliente.
+"""
+import asyncio
+import json
+from typing import Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from metricas import DESCARTADOS, DESCONECTADOS_LENTOS, MENSAJES_SALIENTES
+
+DESCARTAR = "descartar"
+DESCONECTAR = "desconectar"
+
+# Código de cierre 1013: "Try Again Later"
+CODIGO_CLIENTE_LENTO = 1013
+
+
+class Conexion:
+    def __init__(self, websocket: WebSocket, max_pendientes: int = 64, politica: str = DESCONECTAR):
+        self.ws = websocket
+        self.politica = politica
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=max_pendientes)
+        self.cerrada = False
+        # (versión de protocolo, binario) negociados en el join
+        self.formato: Tuple[int, bool] = (1, False)
+        self._tarea: Optional[asyncio.Task] = asyncio.create_task(self._vaciar())
+
+    def enviar(self, datos: Union[str, bytes]):
+        """Encola un mensaje ya serializado (texto o binario) sin esperar al socket."""
+        if self.cerrada:
+            return
+        try:
+            self.cola.put_nowait(datos)
+            MENSAJES_SALIENTES.inc()
+        except asyncio.QueueFull:
+            if self.politica == DESCARTAR:
+                DESCARTADOS.inc()
+            else:
+                DESCONECTADOS_LENTOS.inc()
+                self.cerrada = True
+                asyncio.create_task(self._cerrar_socket())
+
+    def enviar_json(self, mensaje: dict):
+        self.enviar(json.dumps(mensaje))
+
+    async def _vaciar(self):
+        try:
+            while True:
+                datos = await self.cola.get()
+                if isinstance(datos, bytes):
+                    await self.ws.send_bytes(datos)
+                else:
+                    await self.ws.send_text(datos)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # El socket se cerró; el handler de lectura se encarga de limpiar
+            self.cerrada = True
+
+    async def _cerrar_socket(self):
+        await self.cerrar(CODIGO_CLIENTE_LENTO)
+
+    async def cerrar(self, codigo: int, aviso: Optional[dict] = None):
+        """Deja de enviar y cierra el socket; `aviso` se manda antes, sin pasar por la cola."""
+        self.detener()
+        try:
+            if aviso is not None:
+                await self.ws.send_text(json.dumps(aviso))
+            await self.ws.close(code=codigo)
+        except Exception:
+            pass
+
+    def detener(self):
+        self.cerrada = True
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
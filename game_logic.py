@@ -1,45 +1,152 @@
 # game_logic.py
 from typing import List, Optional, Tuple
 
+# Tablero como dos enteros de bits (bit i = casilla i), uno por símbolo.
+# El 3×3 clásico usa máscaras y una tabla precalculada de 512 entradas.
+TABLERO_LLENO = 0x1FF
+
+WIN_MASKS = tuple(
+    (1 << a) | (1 << b) | (1 << c)
+    for a, b, c in [
+        (0, 1, 2),
+        (3, 4, 5),
+        (6, 7, 8),
+        (0, 3, 6),
+        (1, 4, 7),
+        (2, 5, 8),
+        (0, 4, 8),
+        (2, 4, 6),
+    ]
+)
+
+# Tabla precalculada: _GANA[bits] indica si ese conjunto de casillas tiene línea.
+_GANA = tuple(any(bits & m == m for m in WIN_MASKS) for bits in range(TABLERO_LLENO + 1))
+
+
+# Direcciones que se revisan desde la última jugada: fila, columna y diagonales
+DIRECCIONES = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def board_to_bits(board: List[str]) -> Tuple[int, int]:
+    """Convierte un tablero de strings en (bits_x, bits_o)."""
+    x = o = 0
+    for i, cell in enumerate(board):
+        if cell == "X":
+            x |= 1 << i
+        elif cell == "O":
+            o |= 1 << i
+    return x, o
+
+
+def bits_to_board(x: int, o: int, cells: int = 9) -> List[str]:
+    """Convierte (bits_x, bits_o) en el tablero público de strings."""
+    return ["X" if x >> i & 1 else "O" if o >> i & 1 else "" for i in range(cells)]
+
+
+def line_through(bits: int, position: int, size: int, win_length: int) -> bool:
+    """Indica si hay `win_length` fichas seguidas que pasan por `position`."""
+    fila, col = divmod(position, size)
+    for df, dc in DIRECCIONES:
+        cuenta = 1
+        for signo in (1, -1):
+            f, c = fila + df * signo, col + dc * signo
+            while 0 <= f < size and 0 <= c < size and bits >> (f * size + c) & 1:
+                cuenta += 1
+                f += df * signo
+                c += dc * signo
+        if cuenta >= win_length:
+            return True
+    return False
+
+
+def winner_from_bits(x: int, o: int, size: int = 3, win_length: int = 3) -> Optional[str]:
+    """Devuelve "X", "O", "Empate" o None a partir de los bitboards."""
+    if size == 3 and win_length == 3:
+        if _GANA[x]:
+            return "X"
+        if _GANA[o]:
+            return "O"
+    else:
+        # Revisión completa: solo para tableros sueltos, el juego usa la incremental
+        for simbolo, bits in (("X", x), ("O", o)):
+            if any(bits >> i & 1 and line_through(bits, i, size, win_length)
+                   for i in range(size * size)):
+                return simbolo
+    if x | o == (1 << size * size) - 1:
+        return "Empate"
+    return None
+
+
 class TrikiGame:
-    def __init__(self):
-        # Representa el tablero con 9 posiciones (0..8)
-        self.board = [""] * 9
+    # Sin __dict__ por instancia: hay una por sala viva
+    __slots__ = ("size", "win_length", "cells", "full_mask", "x_bits", "o_bits",
+                 "current_player", "winner", "moves", "last_move")
+
+    def __init__(self, size: int = 3, win_length: int = 3):
+        if size < 3 or not 3 <= win_length <= size:
+            raise ValueError("Dimensiones inválidas")
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        # Representa el tablero con size*size posiciones en dos bitboards
+        self.x_bits = 0
+        self.o_bits = 0
         self.current_player = "X"
         self.winner: Optional[str] = None
         self.moves = 0
+        self.last_move: Optional[int] = None
 
     def reset(self):
         """Reinicia el tablero."""
-        self.board = [""] * 9
+        self.x_bits = 0
+        self.o_bits = 0
         self.current_player = "X"
         self.winner = None
         self.moves = 0
+        self.last_move = None
+
+    @property
+    def board(self) -> List[str]:
+        """Tablero público como lista de strings (solo para serializar)."""
+        return bits_to_board(self.x_bits, self.o_bits, self.cells)
+
+    def legal_moves(self) -> int:
+        """Máscara de bits con las casillas libres."""
+        return self.full_mask & ~(self.x_bits | self.o_bits)
+
+    def is_legal(self, position: int) -> bool:
+        """Indica si la casilla existe y está libre."""
+        return 0 <= position < self.cells and not (self.x_bits | self.o_bits) >> position & 1
 
     def make_move(self, position: int) -> Tuple[bool, str]:
         """
         Realiza una jugada.
-        :param position: índice de 0 a 8.
+        :param position: índice de 0 a size*size - 1.
         :return: (éxito, mensaje)
         """
         if self.winner:
             return False, f"Juego terminado. Ganador: {self.winner}"
 
-        if not 0 <= position <= 8:
+        if not 0 <= position < self.cells:
             return False, "Posición inválida"
 
-        if self.board[position] != "":
+        if (self.x_bits | self.o_bits) >> position & 1:
             return False, "Casilla ocupada"
 
         # Realizar jugada
-        self.board[position] = self.current_player
+        if self.current_player == "X":
+            self.x_bits |= 1 << position
+        else:
+            self.o_bits |= 1 << position
         self.moves += 1
+        self.last_move = position
 
         # Verificar si hay ganador o empate
         if self.check_winner():
             self.winner = self.current_player
             return True, f"¡Ganó {self.current_player}!"
-        elif self.moves == 9:
+        elif self.moves == self.cells:
             self.winner = "Empate"
             return True, "Empate"
         else:
@@ -48,25 +155,13 @@ class TrikiGame:
             return True, "Jugada válida"
 
     def check_winner(self) -> bool:
-        """Verifica si el jugador actual ha ganado."""
-        b = self.board
-        combos = [
-            (0, 1, 2),
-            (3, 4, 5),
-            (6, 7, 8),
-            (0, 3, 6),
-            (1, 4, 7),
-            (2, 5, 8),
-            (0, 4, 8),
-            (2, 4, 6),
-        ]
-        for a, b_, c in combos:
-            if (
-                self.board[a] == self.board[b_] == self.board[c]
-                and self.board[a] != ""
-            ):
-                return True
-        return False
+        """Verifica si el jugador actual ganó con su última jugada."""
+        if self.last_move is None:
+            return False
+        bits = self.x_bits if self.current_player == "X" else self.o_bits
+        if self.size == 3 and self.win_length == 3:
+            return _GANA[bits]
+        return line_through(bits, self.last_move, self.size, self.win_length)
 
     def get_board_state(self) -> List[str]:
         """Devuelve el estado actual del tablero."""
@@ -79,8 +174,34 @@ class TrikiGame:
             "current_player": self.current_player,
             "winner": self.winner,
             "moves": self.moves,
+            "size": self.size,
+            "win_length": self.win_length,
         }
 
+    def to_dict(self) -> dict:
+        """Estado compacto (bitboards) para guardarlo fuera del proceso."""
+        return {
+            "size": self.size,
+            "win_length": self.win_length,
+            "x": self.x_bits,
+            "o": self.o_bits,
+            "turn": self.current_player,
+            "winner": self.winner,
+            "moves": self.moves,
+            "last": self.last_move,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrikiGame":
+        juego = cls(data["size"], data["win_length"])
+        juego.x_bits = data["x"]
+        juego.o_bits = data["o"]
+        juego.current_player = data["turn"]
+        juego.winner = data["winner"]
+        juego.moves = data["moves"]
+        juego.last_move = data["last"]
+        return juego
+
     def calculate_score(self, result: str) -> int:
         """
         Calcula puntaje según resultado:
@@ -93,4 +214,4 @@ class TrikiGame:
         elif result == "draw":
             return 1
         else:
-            return 0
\ No newline at end of file
+            return 0
@@ -0,0 +1,107 @@
+# identidades.py
+"""Caché en proceso de nombre de jugador → id.
+
+Los lotes de persistencia necesitan el id de cada jugador para escribir
+partidas y movimientos. En vez de consultar `jugadores` por nombre en cada
+lote, los ids se guardan en un LRU acotado que se llena al hacer `join`
+(fuera del camino de las jugadas). Los nombres que no están en caché se
+resuelven juntos: un solo `INSERT ... ON CONFLICT DO NOTHING` para los
+nuevos y un solo SELECT para traer todos los ids.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Jugador
+
+logger = logging.getLogger(__name__)
+
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class CacheJugadores:
+    def __init__(self, session_factory, max_entradas: int = 10000):
+        self.session_factory = session_factory
+        self.max_entradas = max_entradas
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        # Referencias a las precargas en curso para que no las recolecte el GC
+        self._tareas: Set[asyncio.Task] = set()
+        self._stats = {"aciertos": 0, "fallos": 0, "insertados": 0, "desalojados": 0}
+
+    def get(self, nombre: str) -> Optional[int]:
+        jugador_id = self._ids.get(nombre)
+        if jugador_id is not None:
+            self._ids.move_to_end(nombre)
+        return jugador_id
+
+    def _guardar(self, nombre: str, jugador_id: int):
+        self._ids[nombre] = jugador_id
+        self._ids.move_to_end(nombre)
+        while len(self._ids) > self.max_entradas:
+            self._ids.popitem(last=False)
+            self._stats["desalojados"] += 1
+
+    def invalidar(self, nombres: Optional[Iterable[str]] = None):
+        """Olvida los nombres dados (o todos), p. ej. si su transacción se deshizo."""
+        if nombres is None:
+            self._ids.clear()
+            return
+        for nombre in nombres:
+            self._ids.pop(nombre, None)
+
+    async def resolver(self, db, nombres: Iterable[str]) -> Dict[str, int]:
+        """Ids de `nombres` dentro de la transacción de `db`, creando los que falten.
+
+        Si la transacción no llega a confirmarse hay que llamar a `invalidar`
+        con los mismos nombres: los ids recién insertados no existirían.
+        """
+        ids = {}
+        faltan = []
+        for nombre in set(nombres):
+            jugador_id = self.get(nombre)
+            if jugador_id is None:
+                faltan.append(nombre)
+            else:
+                ids[nombre] = jugador_id
+        self._stats["aciertos"] += len(ids)
+        if not faltan:
+            return ids
+
+        self._stats["fallos"] += len(faltan)
+        insertar = _INSERTS[db.bind.dialect.name]
+        resultado = await db.execute(
+            insertar(Jugador)
+            .values([{"nombre": n, "ganadas": 0, "perdidas": 0, "puntaje": 0} for n in faltan])
+            .on_conflict_do_nothing(index_elements=["nombre"])
+        )
+        self._stats["insertados"] += max(resultado.rowcount, 0)
+        filas = await db.execute(select(Jugador.nombre, Jugador.id).where(Jugador.nombre.in_(faltan)))
+        for nombre, jugador_id in filas:
+            self._guardar(nombre, jugador_id)
+            ids[nombre] = jugador_id
+        return ids
+
+    async def _precargar(self, nombres):
+        pendientes = [n for n in nombres if self.get(n) is None]
+        if not pendientes:
+            return
+        async with self.session_factory() as db:
+            try:
+                await self.resolver(db, pendientes)
+                await db.commit()
+            except Exception:
+                self.invalidar(pendientes)
+                logger.exception("No se pudo precargar jugadores %s", pendientes)
+
+    def precargar(self, *nombres: str):
+        """Resuelve los nombres en segundo plano (llamado al hacer `join`)."""
+        tarea = asyncio.create_task(self._precargar(nombres))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    def metricas(self) -> dict:
+        return {**self._stats, "en_cache": len(self._ids), "max_entradas": self.max_entradas}
@@ -0,0 +1,97 @@
+# leaderboard.py
+"""Clasificación de jugadores mantenida en memoria.
+
+Se carga una vez desde la base de datos al arrancar y luego se actualiza de
+forma incremental cada vez que termina una partida (o entra un jugador
+nuevo), así /api/estadisticas y /api/jugadores no recorren ni ordenan la
+tabla en cada petición. Los nombres de `excluir` (la CPU) no se clasifican.
+"""
+import uuid
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def calcular_puntaje(ganadas: int, perdidas: int) -> int:
+    return ganadas * 3 - perdidas
+
+
+class Clasificacion:
+    def __init__(self, excluir: Iterable[str] = ()):
+        self._excluir = frozenset(excluir)
+        # Claves ordenadas (-ganadas, -puntaje, nombre): el primero es el líder
+        self._orden: List[Tuple[int, int, str]] = []
+        self._jugadores: Dict[str, Tuple[int, int]] = {}
+        self._arranque = uuid.uuid4().hex[:8]
+        self.version = 0
+
+    @staticmethod
+    def _clave(nombre: str, ganadas: int, perdidas: int) -> Tuple[int, int, str]:
+        return (-ganadas, -calcular_puntaje(ganadas, perdidas), nombre)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._arranque}-{self.version}"'
+
+    def cargar(self, filas: Iterable[Tuple[str, int, int]]):
+        """Reemplaza el contenido con filas (nombre, ganadas, perdidas)."""
+        self._jugadores = {nombre: (ganadas or 0, perdidas or 0) for nombre, ganadas, perdidas in filas
+                           if nombre not in self._excluir}
+        self._orden = sorted(self._clave(n, g, p) for n, (g, p) in self._jugadores.items())
+        self.version += 1
+
+    def _actualizar(self, nombre: str, ganadas: int, perdidas: int):
+        anterior = self._jugadores.get(nombre)
+        if anterior is not None:
+            clave = self._clave(nombre, *anterior)
+            del self._orden[bisect_left(self._orden, clave)]
+        self._jugadores[nombre] = (ganadas, perdidas)
+        insort(self._orden, self._clave(nombre, ganadas, perdidas))
+
+    def registrar_partida(self, jugador1: str, jugador2: str, ganador: Optional[str]):
+        """Aplica el resultado de una partida; `ganador` es None si hubo empate."""
+        for nombre in (jugador1, jugador2):
+            if nombre in self._excluir:
+                continue
+            ganadas, perdidas = self._jugadores.get(nombre, (0, 0))
+            if ganador is not None:
+                if nombre == ganador:
+                    ganadas += 1
+                else:
+                    perdidas += 1
+            self._actualizar(nombre, ganadas, perdidas)
+        self.version += 1
+
+    def agregar(self, nombre: str) -> bool:
+        """Suma un jugador sin partidas terminadas. False si ya estaba o se excluye."""
+        if nombre in self._excluir or nombre in self._jugadores:
+            return False
+        self._actualizar(nombre, 0, 0)
+        self.version += 1
+        return True
+
+    def _fila(self, clave: Tuple[int, int, str]) -> dict:
+        nombre = clave[2]
+        ganadas, perdidas = self._jugadores[nombre]
+        return {
+            "nombre": nombre,
+            "ganadas": ganadas,
+            "perdidas": perdidas,
+            "puntaje": calcular_puntaje(ganadas, perdidas),
+        }
+
+    def top(self, k: Optional[int] = None) -> List[dict]:
+        claves = self._orden if k is None else self._orden[:k]
+        return [self._fila(c) for c in claves]
+
+    def posicion(self, nombre: str) -> Optional[dict]:
+        """Fila del jugador con su puesto (1 = líder), o None si no existe."""
+        if nombre not in self._jugadores:
+            return None
+        clave = self._clave(nombre, *self._jugadores[nombre])
+        return {"posicion": bisect_left(self._orden, clave) + 1, **self._fila(clave)}
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self._jugadores
+
+    def __len__(self) -> int:
+        return len(self._orden)
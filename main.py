@@ -1,89 +1,177 @@
 # main.py
+import asyncio
+import base64
+import csv
+import hashlib
+import io
 import json
+import math
+import os
+import secrets
+import time
 import uuid
-from datetime import datetime
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException, Query, Request, Response
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from database import Base, engine, get_db
-from models import Jugador, Partida, Movimiento
-from fastapi.responses import RedirectResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from database import (Base, engine, get_db_lectura, get_async_db_lectura,
+                      SessionLectura, SessionAsync, SessionAsyncLectura, engine_async, engine_async_lectura,
+                      agregar_columnas_faltantes)
+from models import EventoPartida, Jugador, Partida, Movimiento
+from game_logic import board_to_bits, winner_from_bits
+import solver
+import eventlog
+from activos import Activos, etag_coincide
+from admision import RECHAZOS, ControlAdmision, MensajeInvalido, validar_mensaje
+from identidades import CacheJugadores
+from persistence import ColaPersistencia
+from leaderboard import Clasificacion
+from store import CANAL_SISTEMA, crear_store
+from fanout import Conexion
+import metricas
+from metricas import (ACCION_SEGUNDOS, DIFUSION_DESTINOS, DIFUSION_SEGUNDOS, MENSAJES_ENTRANTES,
+                      PERSISTENCIA_PENDIENTES, REANUDACIONES, SALAS_VIVAS, SOCKETS_CONECTADOS)
+from perfilado import Fases, PerfiladorMuestreo, RegistroLento
+from emparejamiento import ColaEmparejamiento
+from analitica import Analiticas
+from protocolo import VERSION_ACTUAL, codificar
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 
 app = FastAPI(title="Triki Multijugador 🎮")
 
 Base.metadata.create_all(bind=engine)
+agregar_columnas_faltantes(engine)
+# create_all no agrega índices nuevos a tablas que ya existen
+for indice in (*Partida.__table__.indexes, *Movimiento.__table__.indexes):
+    indice.create(bind=engine, checkfirst=True)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Estáticos en memoria, precomprimidos y con URLs con hash (ver activos.py)
+activos = Activos("static", "/static", recargar=os.environ.get("TRIKI_ACTIVOS_RECARGA") == "1")
 
-partidas = {}
+TAMANO_MAXIMO = 19
+
+# Estado de las salas (en memoria o compartido entre workers, ver store.py)
+store = crear_store()
+cache_jugadores = CacheJugadores(SessionAsync)
+cola_persistencia = ColaPersistencia(SessionAsync, cache_jugadores)
+# Nombre con el que el solver ocupa su asiento (reservado: ningún jugador puede usarlo)
+NOMBRE_CPU = "CPU"
+clasificacion = Clasificacion(excluir=(NOMBRE_CPU,))
+
+# Diagnóstico: sin TRIKI_ADMIN_TOKEN los endpoints /admin no existen
+ADMIN_TOKEN = os.environ.get("TRIKI_ADMIN_TOKEN")
+perfilador = PerfiladorMuestreo()
+analiticas = Analiticas(SessionLectura, float(os.environ.get("TRIKI_ANALITICA_REFRESCO_SEG", 5)))
+jugadas_lentas = RegistroLento(float(os.environ.get("TRIKI_JUGADA_LENTA_MS", 50)))
+
+# Admisión al socket de juego (ver admision.py). Para pruebas de carga desde
+# una sola máquina hay que subir TRIKI_MAX_CONEXIONES_IP y TRIKI_WS_MENSAJES_IP_SEG.
+admision = ControlAdmision(
+    max_conexiones=int(os.environ.get("TRIKI_MAX_CONEXIONES", 10000)),
+    max_por_ip=int(os.environ.get("TRIKI_MAX_CONEXIONES_IP", 100)),
+    tasa_socket=float(os.environ.get("TRIKI_WS_MENSAJES_SEG", 20)),
+    rafaga_socket=float(os.environ.get("TRIKI_WS_RAFAGA", 40)),
+    tasa_ip=float(os.environ.get("TRIKI_WS_MENSAJES_IP_SEG", 200)),
+    rafaga_ip=float(os.environ.get("TRIKI_WS_RAFAGA_IP", 400)),
+    umbral_lag_ms=float(os.environ.get("TRIKI_LAG_MAX_MS", 200)),
+)
+MAX_BYTES_MENSAJE = int(os.environ.get("TRIKI_WS_MAX_BYTES", 4096))
+
+
+@app.on_event("startup")
+async def iniciar_servicios():
+    # Resuelve el Triki una sola vez para que la CPU responda sin buscar
+    solver.precalcular()
+    async with SessionAsyncLectura() as db:
+        clasificacion.cargar(await db.execute(select(Jugador.nombre, Jugador.ganadas, Jugador.perdidas)))
+    await cola_persistencia.iniciar()
+    await store.iniciar(entregar, en_uso=conexiones)
+    await emparejamiento.iniciar()
+    await admision.iniciar()
+    for partida_id, sala in (await asyncio.to_thread(recuperar_salas)).items():
+        await store.restaurar(partida_id, sala)
+
+
+def recuperar_salas():
+    """Reconstruye desde la bitácora las salas con actividad reciente."""
+    db = SessionLectura()
+    try:
+        desde = datetime.utcnow() - timedelta(seconds=store.ttl_seg)
+        salas = {codigo: eventlog.reconstruir(db, codigo) for codigo in eventlog.codigos_activos(db, desde)}
+        return {codigo: sala for codigo, sala in salas.items() if sala is not None}
+    finally:
+        db.close()
+
+
+@app.on_event("shutdown")
+async def detener_servicios():
+    await emparejamiento.detener()
+    await admision.detener()
+    await store.detener()
+    await cola_persistencia.detener()
+    # Cierra los hilos de aiosqlite para que el proceso pueda terminar
+    await engine_async.dispose()
+    await engine_async_lectura.dispose()
 
 # ======================
 #   FUNCIONES AUXILIARES
 # ======================
 
-def check_winner(board):
-    combos = [(0,1,2), (3,4,5), (6,7,8),
-              (0,3,6), (1,4,7), (2,5,8),
-              (0,4,8), (2,4,6)]
-    for a,b,c in combos:
-        if board[a] and board[a] == board[b] == board[c]:
-            return board[a]
-    if "" not in board:
-        return "Empate"
-    return None
-
-def get_or_create_jugador(db: Session, nombre: str):
-    jugador = db.query(Jugador).filter_by(nombre=nombre).first()
-    if not jugador:
-        jugador = Jugador(nombre=nombre)
-        db.add(jugador)
-        db.commit()
-        db.refresh(jugador)
-    return jugador
+def check_winner(board, en_linea=3):
+    tamano = math.isqrt(len(board))
+    return winner_from_bits(*board_to_bits(board), tamano, en_linea)
+
+def respuesta_con_etag(request: Request, etag: str, contenido):
+    """Devuelve 304 si el cliente ya tiene la versión `etag` del recurso."""
+    if etag_coincide(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(contenido, headers={"ETag": etag})
 
 # ======================
 #   ENDPOINTS PRINCIPALES
 # ======================
 
 @app.get("/", response_class=HTMLResponse)
-def index():
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+def index(request: Request):
+    return activos.responder("index.html", request)
+
+@app.api_route("/static/{ruta:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def archivo_estatico(ruta: str, request: Request):
+    return activos.responder(ruta, request)
 
 from fastapi import status
 from fastapi.responses import JSONResponse
 
 @app.post("/api/create_partida")
-def api_create_partida():
+async def api_create_partida(tamano: int = Query(3, ge=3, le=TAMANO_MAXIMO),
+                       en_linea: int = Query(3, ge=3, le=TAMANO_MAXIMO)):
     """Crea partida vía API POST (compatibilidad con front)."""
+    if en_linea > tamano:
+        raise HTTPException(status_code=400, detail="en_linea no puede superar el tamaño del tablero")
     partida_id = str(uuid.uuid4())[:8]
-    partidas[partida_id] = {
-        "jugadores": {},
-        "board": ["" for _ in range(9)],
-        "turn": "X",
-        "ganador": None,
-        "timestamp": datetime.utcnow()
-    }
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content={"partida_id": partida_id})
+    await store.crear(partida_id, tamano, en_linea)
+    await actualizar_sala(partida_id, lambda sala, registrar: registrar("create", tamano=tamano, en_linea=en_linea))
+    return JSONResponse(status_code=status.HTTP_201_CREATED, content={
+        "partida_id": partida_id,
+        "tamano": tamano,
+        "en_linea": en_linea
+    })
 
 
 @app.get("/api/estadisticas")
-def get_estadisticas(db: Session = Depends(get_db)):
-    jugadores = (
-        db.query(Jugador)
-        .order_by(Jugador.ganadas.desc(), Jugador.puntaje.desc())
-        .all()
-    )
-    return [
-        {
-            "nombre": j.nombre,
-            "ganadas": j.ganadas,
-            "perdidas": j.perdidas,
-            "puntaje": j.puntaje,
-        }
-        for j in jugadores
-    ]
+async def get_estadisticas(request: Request, limite: Optional[int] = Query(None, ge=1)):
+    """Clasificación ordenada por (ganadas, puntaje); `limite` devuelve solo el top-K."""
+    return respuesta_con_etag(request, clasificacion.etag, clasificacion.top(limite))
+
+@app.get("/api/estadisticas/{nombre}")
+def get_estadisticas_jugador(nombre: str):
+    fila = clasificacion.posicion(nombre)
+    if fila is None:
+        raise HTTPException(status_code=404, detail="Jugador no encontrado")
+    return fila
 
 
 
@@ -107,157 +195,856 @@ def ver_historico():
 # ======================
 
 @app.get("/api/jugadores")
-def api_jugadores(db: Session = Depends(get_db)):
-    jugadores = db.query(Jugador).all()
-    data = []
-    for j in jugadores:
-        puntaje = j.ganadas * 3 - j.perdidas
-        data.append({
-            "nombre": j.nombre,
-            "ganadas": j.ganadas,
-            "perdidas": j.perdidas,
-            "puntaje": puntaje
-        })
-    return data
+async def api_jugadores(request: Request):
+    return respuesta_con_etag(request, clasificacion.etag, clasificacion.top())
+
+@app.get("/api/partidas/{codigo}/replay")
+def api_replay(codigo: str, seq: Optional[int] = Query(None, ge=0), db: Session = Depends(get_db_lectura)):
+    """Estado de la sala `codigo` tras el evento número `seq` de su bitácora (o el último)."""
+    sala = eventlog.reconstruir(db, codigo, seq)
+    if sala is None:
+        raise HTTPException(status_code=404, detail="Partida sin bitácora")
+    juego = sala.juego
+    return {
+        "codigo": codigo,
+        "seq": sala.eventos,
+        "size": juego.size,
+        "win_length": juego.win_length,
+        "board": juego.get_board_state(),
+        "turn": juego.current_player,
+        "winner": juego.winner,
+        "asientos": sala.asientos,
+        "jugadas": [pos for _, pos, _ in sala.jugadas]
+    }
+
+@app.get("/api/salas")
+async def api_salas():
+    """Salas vivas, expiradas por inactividad y desalojadas por el límite."""
+    return await store.metricas()
+
+@app.get("/api/persistencia")
+def api_persistencia():
+    """Métricas de la cola de escritura diferida y de la caché de jugadores."""
+    return {**cola_persistencia.metricas(), "jugadores": cache_jugadores.metricas()}
+
+@app.get("/api/emparejamiento")
+def api_emparejamiento():
+    """Jugadores en cola por banda de puntaje, parejas formadas y espera media."""
+    return emparejamiento.metricas()
+
+@app.get("/api/admision")
+def api_admision():
+    """Conexiones abiertas, IPs distintas y atraso del event loop."""
+    return admision.metricas()
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    SALAS_VIVAS.set(await store.contar())
+    PERSISTENCIA_PENDIENTES.set(cola_persistencia.metricas()["pendientes"])
+    return Response(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def codificar_cursor(fecha: datetime, partida_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}|{partida_id}".encode()).decode()
+
+def decodificar_cursor(cursor: str):
+    try:
+        fecha, partida_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(fecha), int(partida_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def consulta_historico(jugador=None, desde=None, hasta=None):
+    """(id, fecha, jugador1, jugador2, ganador) con los nombres resueltos en un solo JOIN.
+
+    Devuelve un `select()` para poder ejecutarlo tanto en sesión async como síncrona.
+    """
+    J1, J2, G = aliased(Jugador), aliased(Jugador), aliased(Jugador)
+    query = (
+        select(Partida.id, Partida.fecha, J1.nombre, J2.nombre, G.nombre)
+        .join(J1, Partida.jugador1)
+        .join(J2, Partida.jugador2)
+        .outerjoin(G, Partida.ganador)
+    )
+    if jugador:
+        # Por id y no por nombre de los alias: así se usan los índices de
+        # jugador1_id/jugador2_id. Un nombre desconocido da NULL y página vacía
+        jugador_id = select(Jugador.id).where(Jugador.nombre == jugador).scalar_subquery()
+        query = query.where(or_(Partida.jugador1_id == jugador_id, Partida.jugador2_id == jugador_id))
+    if desde:
+        query = query.where(Partida.fecha >= desde)
+    if hasta:
+        query = query.where(Partida.fecha < hasta)
+    return query
 
 @app.get("/api/historico")
-def api_historico(db: Session = Depends(get_db)):
-    partidas = db.query(Partida).all()
-    data = []
-    for p in partidas:
-        ganador = None
-        if p.ganador_id:
-            ganador = db.query(Jugador).filter(Jugador.id == p.ganador_id).first().nombre
-        j1 = db.query(Jugador).filter(Jugador.id == p.jugador1_id).first().nombre
-        j2 = db.query(Jugador).filter(Jugador.id == p.jugador2_id).first().nombre
-        data.append({
-            "jugador1": j1,
-            "jugador2": j2,
-            "ganador": ganador or "Empate",
-            "fecha": p.fecha.strftime("%Y-%m-%d %H:%M:%S")
-        })
-    return data
+async def api_historico(limit: int = Query(50, ge=1, le=500),
+                        cursor: Optional[str] = None,
+                        jugador: Optional[str] = None,
+                        desde: Optional[datetime] = None,
+                        hasta: Optional[datetime] = None,
+                        db: AsyncSession = Depends(get_async_db_lectura)):
+    """Partidas de la más reciente a la más antigua, paginadas por (fecha, id)."""
+    query = consulta_historico(jugador, desde, hasta)
+    if cursor:
+        fecha, partida_id = decodificar_cursor(cursor)
+        query = query.where(or_(
+            Partida.fecha < fecha,
+            and_(Partida.fecha == fecha, Partida.id < partida_id)
+        ))
+
+    resultado = await db.execute(query.order_by(Partida.fecha.desc(), Partida.id.desc()).limit(limit + 1))
+    filas = resultado.all()
+    siguiente = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        siguiente = codificar_cursor(filas[-1][1], filas[-1][0])
+
+    return {
+        "partidas": [
+            {
+                "jugador1": j1,
+                "jugador2": j2,
+                "ganador": ganador or "Empate",
+                "fecha": fecha.strftime("%Y-%m-%d %H:%M:%S")
+            }
+            for _, fecha, j1, j2, ganador in filas
+        ],
+        "siguiente": siguiente
+    }
+
+# ======================
+#   EXPORTACIÓN
+# ======================
+
+FILAS_POR_BLOQUE = 1000
+
+def _valor_exportable(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+def exportar(columnas, consulta, formato: str, nombre_archivo: str):
+    """Transmite el resultado de la consulta como NDJSON o CSV con memoria constante."""
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato debe ser ndjson o csv")
+
+    def generar():
+        # Sesión propia: la de Depends se cerraría antes de terminar el streaming
+        db = SessionLectura()
+        try:
+            filas = db.execute(consulta.execution_options(stream_results=True)).yield_per(FILAS_POR_BLOQUE)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if formato == "csv":
+                writer.writerow(columnas)
+            for i, fila in enumerate(filas, 1):
+                valores = [_valor_exportable(v) for v in fila]
+                if formato == "csv":
+                    writer.writerow(valores)
+                else:
+                    buffer.write(json.dumps(dict(zip(columnas, valores)), ensure_ascii=False))
+                    buffer.write("\n")
+                if i % FILAS_POR_BLOQUE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            db.close()
+
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(generar(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{nombre_archivo}.{formato}"'
+    })
+
+@app.get("/api/historico/export")
+def api_historico_export(formato: str = "ndjson",
+                         jugador: Optional[str] = None,
+                         desde: Optional[datetime] = None,
+                         hasta: Optional[datetime] = None):
+    return exportar(
+        ["id", "fecha", "jugador1", "jugador2", "ganador"],
+        consulta_historico(jugador, desde, hasta).order_by(Partida.id),
+        formato,
+        "historico"
+    )
+
+@app.get("/api/movimientos/export")
+def api_movimientos_export(formato: str = "ndjson", partida_id: Optional[int] = None):
+    query = (
+        select(Movimiento.id, Movimiento.partida_id, Jugador.nombre,
+               Movimiento.posicion, Movimiento.turno, Movimiento.timestamp)
+        .outerjoin(Jugador, Movimiento.jugador_id == Jugador.id)
+    )
+    if partida_id is not None:
+        query = query.where(Movimiento.partida_id == partida_id)
+
+    return exportar(
+        ["id", "partida_id", "jugador", "posicion", "turno", "timestamp"],
+        query.order_by(Movimiento.id),
+        formato,
+        "movimientos"
+    )
+
+# ======================
+#   ANALÍTICA
+# ======================
+
+@app.get("/api/analytics/resumen")
+async def api_analytics_resumen(tamano: int = Query(3, ge=3, le=TAMANO_MAXIMO)):
+    """Partidas, proporción de victorias de X, de O y empates, y distribución de largos."""
+    return (await analiticas.obtener(tamano)).resumen()
+
+@app.get("/api/analytics/celdas")
+async def api_analytics_celdas(tamano: int = Query(3, ge=3, le=TAMANO_MAXIMO)):
+    """Por turno y casilla: veces jugada, tasa de victoria de quien la jugó y de empate."""
+    return (await analiticas.obtener(tamano)).celdas_por_turno()
+
+@app.get("/api/analytics/aperturas")
+async def api_analytics_aperturas(tamano: int = Query(3, ge=3, le=TAMANO_MAXIMO),
+                                  limite: int = Query(10, ge=1, le=100)):
+    """Primeras jugadas y pares (apertura, respuesta) más comunes con sus resultados."""
+    return (await analiticas.obtener(tamano)).aperturas_comunes(limite)
+
+# ======================
+#   ADMINISTRACIÓN
+# ======================
+
+def verificar_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+@app.post("/admin/perfil", dependencies=[Depends(verificar_admin)])
+async def admin_perfil(segundos: float = Query(10, gt=0, le=120),
+                       intervalo_ms: float = Query(5, ge=1, le=1000)):
+    """Perfila el proceso `segundos` y devuelve pilas colapsadas (flamegraph.pl, speedscope)."""
+    if perfilador.activo:
+        raise HTTPException(status_code=409, detail="Ya hay un perfilado en curso")
+    try:
+        pilas = await asyncio.to_thread(perfilador.muestrear, segundos, intervalo_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(pilas, headers={
+        "Content-Disposition": f'attachment; filename="perfil-{int(time.time())}.folded"'
+    })
+
+@app.get("/admin/jugadas-lentas", dependencies=[Depends(verificar_admin)])
+def admin_jugadas_lentas():
+    """Últimas jugadas que superaron TRIKI_JUGADA_LENTA_MS, con el tiempo de cada fase."""
+    return {
+        "umbral_ms": jugadas_lentas.umbral_ms,
+        "total": jugadas_lentas.total,
+        "jugadas": jugadas_lentas.recientes()
+    }
 
 # ======================
 #   WEBSOCKET
 # ======================
 
-@app.websocket("/ws/{partida_id}")
-async def websocket_endpoint(websocket: WebSocket, partida_id: str, db: Session = Depends(get_db)):
-    await websocket.accept()
-
-    if partida_id not in partidas:
-        partidas[partida_id] = {
-            "jugadores": {},
-            "board": ["" for _ in range(9)],
-            "turn": "X",
-            "ganador": None
+# Mensajes pendientes por socket antes de desconectar a un cliente lento
+MAX_MENSAJES_PENDIENTES = 64
+
+# Descartes de tasa seguidos antes de cerrar el socket (código 1008)
+MAX_DESCARTES_SEGUIDOS = 100
+
+# Cierre del socket anterior cuando otra conexión reanuda su sesión
+CODIGO_SESION_REEMPLAZADA = 4001
+
+# Segundos que se guarda el asiento de quien se desconecta (0: se libera al instante)
+GRACIA_RECONEXION_SEG = float(os.environ.get("TRIKI_GRACIA_RECONEXION_SEG", 30))
+# Plazo para que cada jugador emparejado entre a su sala; si no llega, el
+# asiento se libera como el de quien se desconecta
+ESPERA_EMPAREJADO_SEG = max(GRACIA_RECONEXION_SEG, 10)
+# Jugadas recientes por sala que se reenvían al reanudar; si faltan más, va una foto
+MAX_JUGADAS_REENVIO = 32
+
+# Sockets conectados a este worker: partida_id -> {nombre: Conexion}
+conexiones = {}
+
+# Asientos en gracia con su liberación programada en este worker: (partida_id, nombre) -> Task
+liberaciones = {}
+
+
+def mensaje_estado(sala):
+    """Foto completa de la sala; protocolo.py la codifica para cada cliente."""
+    juego = sala.juego
+    return {
+        "type": "state",
+        "seq": sala.seq,
+        "size": juego.size,
+        "win_length": juego.win_length,
+        "x": juego.x_bits,
+        "o": juego.o_bits,
+        "turn": juego.current_player,
+        "winner": juego.winner
+    }
+
+
+async def entregar(partida_id, mensaje):
+    """Reparte un mensaje publicado en el store a los sockets de este worker."""
+    if partida_id == CANAL_SISTEMA:
+        if mensaje["type"] == "partida_terminada":
+            clasificacion.registrar_partida(mensaje["jugador1"], mensaje["jugador2"], mensaje["ganador"])
+            analiticas.marcar_pendiente()
+        elif mensaje["type"] == "jugador_nuevo":
+            clasificacion.agregar(mensaje["nombre"])
+        return
+    locales = conexiones.get(partida_id)
+    if not locales:
+        return
+    DIFUSION_DESTINOS.observe(len(locales))
+    with DIFUSION_SEGUNDOS.medir():
+        # Se serializa una sola vez por formato y cada conexión lo envía desde su propia cola
+        codificados = {}
+        for conexion in locales.values():
+            formato = conexion.formato
+            if mensaje.get("solo_v1") and formato[0] >= 2:
+                continue
+            datos = codificados.get(formato)
+            if datos is None:
+                datos = codificados[formato] = codificar(mensaje, *formato)
+            conexion.enviar(datos)
+
+
+class SalaSinNumerar(Exception):
+    """La sala aún no registró eventos y falta saber desde qué número seguir."""
+
+
+async def ultimo_evento(codigo):
+    """Último número de la bitácora de `codigo`, contando lo que aún no se escribió."""
+    async with SessionAsyncLectura() as db:
+        en_base = (await db.execute(
+            select(func.max(EventoPartida.num)).where(EventoPartida.codigo == codigo)
+        )).scalar()
+    return max(en_base or 0, cola_persistencia.ultimo_evento_pendiente(codigo))
+
+
+async def actualizar_sala(partida_id, fn, base=None):
+    """store.actualizar con bitácora: `fn(sala, registrar)` llama a
+    `registrar(tipo, **datos)` después de aplicar cada cambio a la sala.
+
+    Una sala sin eventos puede reusar un código que ya tiene bitácora (sala
+    expirada o desalojada y vuelta a crear): la numeración sigue desde el
+    último evento guardado para no chocar con uq_evento_codigo_num.
+    """
+    def envoltura(sala):
+        pendientes = []
+        nueva = sala.eventos == 0
+        if nueva:
+            if base is None:
+                raise SalaSinNumerar
+            sala.eventos = base
+
+        def registrar(tipo, **datos):
+            if nueva and not pendientes and tipo != "create":
+                # Sala creada implícitamente al conectarse a un ID nuevo
+                pendientes.extend(eventlog.registrar(sala, "create", {
+                    "tamano": sala.juego.size, "en_linea": sala.juego.win_length
+                }))
+            pendientes.extend(eventlog.registrar(sala, tipo, datos))
+
+        resultado = fn(sala, registrar)
+        if nueva and not pendientes:
+            # No registró nada: el próximo cambio vuelve a consultar la base
+            sala.eventos = 0
+        return resultado, pendientes
+
+    try:
+        resultado, pendientes = await store.actualizar(partida_id, envoltura)
+    except SalaSinNumerar:
+        return await actualizar_sala(partida_id, fn, await ultimo_evento(partida_id))
+    if pendientes:
+        await cola_persistencia.encolar_eventos(partida_id, pendientes)
+    return resultado
+
+
+def aplicar_jugada(sala, registrar, jugador_nombre, pos):
+    """Aplica la jugada sobre la sala. Devuelve None si es ilegal."""
+    juego = sala.juego
+    simbolo = juego.current_player
+    ok, _ = juego.make_move(pos)
+    if not ok:
+        return None
+    sala.seq += 1
+    ts = time.time()
+    sala.jugadas.append([jugador_nombre, pos, ts])
+    registrar("move", nombre=jugador_nombre, pos=pos, ts=ts)
+    final = None
+    if juego.winner:
+        j1, j2 = sala.nombre_de("X"), sala.nombre_de("O")
+        ganador = None if juego.winner == "Empate" else sala.nombre_de(juego.winner)
+        registrar("finish", ganador=ganador)
+        final = {
+            "tamano": juego.size,
+            "en_linea": juego.win_length,
+            "jugador1": j1,
+            "jugador2": j2,
+            "ganador": ganador,
+            "jugadas": [list(j) for j in sala.jugadas]
         }
+    mensaje = {
+        "type": "move_result",
+        "seq": sala.seq,
+        "size": juego.size,
+        "x": juego.x_bits,
+        "o": juego.o_bits,
+        "pos": pos,
+        "sym": simbolo,
+        "turn": juego.current_player,
+        "winner": juego.winner
+    }
+    sala.recientes.append(mensaje)
+    del sala.recientes[:-MAX_JUGADAS_REENVIO]
+    return {"mensaje": mensaje, "final": final}
+
+
+async def difundir_jugada(partida_id, jugada, fases=None):
+    """Difunde la jugada y, si terminó la partida, la encola para persistir."""
+    await store.publicar(partida_id, jugada["mensaje"])
+    if fases:
+        fases.marcar("broadcast")
+    final = jugada["final"]
+    if final:
+        await cola_persistencia.encolar_partida(partida_id, **final)
+        if final["jugador1"] and final["jugador2"]:
+            await store.publicar(CANAL_SISTEMA, {
+                "type": "partida_terminada",
+                "jugador1": final["jugador1"],
+                "jugador2": final["jugador2"],
+                "ganador": final["ganador"]
+            })
+        if fases:
+            fases.marcar("persist")
+
+
+async def crear_sala_emparejada(nombre_x, nombre_o):
+    """Sala nueva con los dos asientos ya reservados para la pareja.
+
+    Cada asiento queda atado a un token: el jugador lo reclama con
+    {"action": "resume", "name", "token"}, no con un join por nombre. Hasta
+    entonces cuenta como ausente: si no llega en ESPERA_EMPAREJADO_SEG el
+    asiento se libera.
+    """
+    partida_id = str(uuid.uuid4())[:8]
+    await store.crear(partida_id)
+    tokens = {nombre_x: secrets.token_urlsafe(16), nombre_o: secrets.token_urlsafe(16)}
+    plazo = time.time() + ESPERA_EMPAREJADO_SEG
+
+    def sentar(sala, registrar):
+        registrar("create", tamano=sala.juego.size, en_linea=sala.juego.win_length)
+        for nombre, simbolo in ((nombre_x, "X"), (nombre_o, "O")):
+            sala.asientos[nombre] = simbolo
+            sala.reanudacion[nombre] = digesto_token(tokens[nombre])
+            sala.ausentes[nombre] = plazo
+            registrar("join", nombre=nombre, simbolo=simbolo)
+
+    await actualizar_sala(partida_id, sentar)
+    for nombre in tokens:
+        programar_liberacion(partida_id, nombre, plazo)
+    return partida_id, tokens
+
+
+def solver_juega(juego):
+    """El solver solo tiene tabla para el Triki clásico 3×3 con 3 en línea."""
+    return juego.size == 3 and juego.win_length == 3
+
+
+async def registrar_jugador(nombre):
+    """Deja resuelto su id antes de que termine la partida y, si es nuevo, lo
+    suma a la clasificación de todos los workers (como antes, /api/jugadores
+    lista también a quien aún no terminó ninguna partida)."""
+    cache_jugadores.precargar(nombre)
+    if nombre not in clasificacion and nombre != NOMBRE_CPU:
+        await store.publicar(CANAL_SISTEMA, {"type": "jugador_nuevo", "nombre": nombre})
+
+
+def digesto_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def mensajes_perdidos(sala, ultimo_seq):
+    """Lo que le falta a un cliente que vio hasta `ultimo_seq`: las jugadas
+    siguientes si siguen en `sala.recientes`, si no una foto completa."""
+    if ultimo_seq == sala.seq:
+        return []
+    recientes = sala.recientes
+    if (ultimo_seq is not None and recientes and recientes[-1]["seq"] == sala.seq
+            and recientes[0]["seq"] <= ultimo_seq + 1 and ultimo_seq < sala.seq):
+        return [m for m in recientes if m["seq"] > ultimo_seq]
+    return [mensaje_estado(sala)]
+
+
+def cancelar_liberacion(partida_id, nombre):
+    tarea = liberaciones.pop((partida_id, nombre), None)
+    if tarea:
+        tarea.cancel()
+
+
+def desplazar_conexion(partida_id, nombre, conexion):
+    """Registra `conexion` como la de `nombre` y cierra la que tuviera antes.
+
+    La anterior deja de recibir difusiones, así que no debe seguir jugando
+    sobre un tablero viejo; se le avisa y se cierra.
+    """
+    locales = conexiones.setdefault(partida_id, {})
+    anterior = locales.get(nombre)
+    locales[nombre] = conexion
+    if anterior is not None and anterior is not conexion:
+        asyncio.create_task(anterior.cerrar(CODIGO_SESION_REEMPLAZADA, {
+            "type": "error", "message": "La sesión se abrió en otra conexión"}))
+
+
+def programar_liberacion(partida_id, nombre, plazo):
+    cancelar_liberacion(partida_id, nombre)
+    liberaciones[(partida_id, nombre)] = asyncio.create_task(
+        liberar_asiento(partida_id, nombre, plazo))
+
+
+async def liberar_asiento(partida_id, nombre, plazo):
+    """Al vencer la gracia suelta el asiento, salvo que el jugador haya vuelto."""
+    await asyncio.sleep(max(0.0, plazo - time.time()))
+    liberaciones.pop((partida_id, nombre), None)
+
+    def salir(sala, registrar):
+        if sala.ausentes.get(nombre) != plazo:
+            return
+        del sala.ausentes[nombre]
+        sala.reanudacion.pop(nombre, None)
+        if sala.asientos.pop(nombre, "ausente") != "ausente":
+            registrar("leave", nombre=nombre)
+
+    await actualizar_sala(partida_id, salir)
+
+
+async def soltar_socket(partida_id, jugador_nombre, simbolo, conexion):
+    """Detiene el envío del socket y le guarda (o libera) el asiento."""
+    conexion.detener()
+    locales = conexiones.get(partida_id, {})
+    # Si otro socket ya tomó este nombre (p. ej. reanudó antes de que este
+    # cerrara), el asiento es de ese socket y no se toca
+    if not jugador_nombre or locales.get(jugador_nombre) is not conexion:
+        return
+    del locales[jugador_nombre]
+    if not locales:
+        del conexiones[partida_id]
+
+    if simbolo and GRACIA_RECONEXION_SEG > 0:
+        plazo = time.time() + GRACIA_RECONEXION_SEG
+
+        def ausentar(sala, registrar):
+            if sala.asientos.get(jugador_nombre) != simbolo:
+                return False
+            sala.ausentes[jugador_nombre] = plazo
+            return True
+
+        if await actualizar_sala(partida_id, ausentar):
+            programar_liberacion(partida_id, jugador_nombre, plazo)
+    else:
+        def salir(sala, registrar):
+            sala.reanudacion.pop(jugador_nombre, None)
+            if sala.asientos.pop(jugador_nombre, "ausente") != "ausente":
+                registrar("leave", nombre=jugador_nombre)
+
+        await actualizar_sala(partida_id, salir)
+
+
+emparejamiento = ColaEmparejamiento(
+    crear_sala_emparejada,
+    ancho_banda=int(os.environ.get("TRIKI_EMPAREJAR_BANDA", 10)),
+    intervalo_ms=int(os.environ.get("TRIKI_EMPAREJAR_INTERVALO_MS", 100)),
+    ampliar_tras_seg=float(os.environ.get("TRIKI_EMPAREJAR_AMPLIAR_SEG", 5)),
+)
+
+
+# Debe declararse antes de /ws/{partida_id}, que también la capturaría
+@app.websocket("/ws/matchmaking")
+async def websocket_emparejamiento(websocket: WebSocket):
+    """Espera un rival: {"action": "join", "name"} -> {"type": "match", "partida_id", "rival", "symbol", "token"}.
+
+    Después el cliente se conecta a /ws/{partida_id} y reclama su asiento
+    reservado con {"action": "resume", "name", "token"}.
+    """
+    ip = websocket.client.host if websocket.client else "desconocida"
+    if admision.admitir(ip):
+        await websocket.close(code=1013)
+        return
+    espera = None
+    try:
+        await websocket.accept()
+        mensaje = await websocket.receive()
+        if mensaje["type"] == "websocket.disconnect":
+            return
+        if not admision.permitir(ip, admision.cubeta_socket()):
+            await websocket.send_json({"type": "error", "message": "Demasiados mensajes"})
+            await websocket.close(code=1008)
+            return
+        try:
+            data = validar_mensaje(mensaje.get("text"), MAX_BYTES_MENSAJE)
+            if data["action"] != "join":
+                raise MensajeInvalido("Se esperaba join")
+            if data["name"] == NOMBRE_CPU:
+                raise MensajeInvalido("Ese nombre está reservado")
+        except MensajeInvalido as e:
+            RECHAZOS.labels("invalido").inc()
+            await websocket.send_json({"type": "error", "message": str(e)})
+            await websocket.close(code=1008)
+            return
+        nombre = data["name"]
+        fila = clasificacion.posicion(nombre)
+        espera = emparejamiento.encolar(nombre, fila["puntaje"] if fila else 0)
+        await websocket.send_json({"type": "info", "message": "Buscando rival"})
+
+        # Cualquier mensaje (o cerrar el socket) mientras espera cancela la búsqueda
+        lectura = asyncio.ensure_future(websocket.receive_text())
+        await asyncio.wait({espera.futuro, lectura}, return_when=asyncio.FIRST_COMPLETED)
+        if lectura.done() or espera.futuro.cancelled():
+            emparejamiento.cancelar(espera)
+            if not lectura.done():
+                # Otro socket con el mismo nombre tomó su lugar en la cola
+                lectura.cancel()
+                await websocket.close()
+            elif lectura.exception() is None:
+                await websocket.close()
+            return
+        lectura.cancel()
+        if espera.futuro.exception():
+            await websocket.send_json({"type": "error", "message": str(espera.futuro.exception())})
+        else:
+            await websocket.send_json({"type": "match", **espera.futuro.result()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if espera:
+            emparejamiento.cancelar(espera)
+        admision.liberar(ip)
+
+
+@app.websocket("/ws/{partida_id}")
+async def websocket_endpoint(websocket: WebSocket, partida_id: str, vs_cpu: bool = False):
+    ip = websocket.client.host if websocket.client else "desconocida"
+    if admision.admitir(ip):
+        # Cerrar antes de aceptar rechaza el handshake sin gastar más en el socket
+        await websocket.close(code=1013)
+        return
+    try:
+        await websocket.accept()
+    except Exception:
+        admision.liberar(ip)
+        raise
+    conexion = Conexion(websocket, MAX_MENSAJES_PENDIENTES)
+    cubeta = admision.cubeta_socket()
+    descartes = 0
+    SOCKETS_CONECTADOS.inc()
 
-    partida = partidas[partida_id]
     jugador_nombre = None
     simbolo = None
 
+    # Modo contra la CPU: el solver ocupa el asiento O si está libre (solo 3×3)
+    def sentar_cpu(sala, registrar):
+        if solver_juega(sala.juego) and sala.cpu is None and sala.nombre_de("O") is None:
+            sala.asientos[NOMBRE_CPU] = "O"
+            sala.cpu = "O"
+            registrar("join", nombre=NOMBRE_CPU, simbolo="O", cpu=True)
+
     try:
+        if vs_cpu:
+            await actualizar_sala(partida_id, sentar_cpu)
+            cache_jugadores.precargar(NOMBRE_CPU)
+
         while True:
-            msg = await websocket.receive_text()
-            data = json.loads(msg)
-            action = data.get("action")
-
-            if action == "join":
-                jugador_nombre = data.get("name")
-                if not jugador_nombre:
-                    await websocket.send_json({"type": "error", "message": "Falta nombre."})
-                    continue
-
-                if "X" not in [j["symbol"] for j in partida["jugadores"].values()]:
-                    simbolo = "X"
-                elif "O" not in [j["symbol"] for j in partida["jugadores"].values()]:
-                    simbolo = "O"
-                else:
-                    simbolo = None  # espectador
-
-                partida["jugadores"][jugador_nombre] = {"ws": websocket, "symbol": simbolo}
-
-                await websocket.send_json({
-                    "type": "info",
-                    "message": f"Conectado como {simbolo or 'Espectador'}",
-                    "symbol": simbolo
-                })
-                for j, info in partida["jugadores"].items():
-                    await info["ws"].send_json({
-                        "type": "state",
-                        "board": partida["board"],
-                        "turn": partida["turn"],
-                        "winner": partida["ganador"]
-                    })
+            mensaje = await websocket.receive()
+            if mensaje["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(mensaje.get("code", 1000))
+            recibido = time.perf_counter()
+            MENSAJES_ENTRANTES.inc()
 
-            elif action == "move":
-                if not simbolo or simbolo != partida["turn"]:
-                    await websocket.send_json({"type": "error", "message": "No es tu turno"})
-                    continue
-
-                pos = data.get("position")
-                if pos is None or partida["board"][pos] != "" or partida["ganador"]:
-                    continue
-
-                partida["board"][pos] = simbolo
-                partida["turn"] = "O" if partida["turn"] == "X" else "X"
-                ganador = check_winner(partida["board"])
-                partida["ganador"] = ganador
-
-                for j, info in partida["jugadores"].items():
-                    await info["ws"].send_json({
-                        "type": "move_result",
-                        "board": partida["board"],
-                        "turn": partida["turn"],
-                        "winner": ganador
-                    })
+            if not admision.permitir(ip, cubeta):
+                descartes += 1
+                if descartes == 1:
+                    conexion.enviar_json({"type": "error", "message": "Demasiados mensajes"})
+                elif descartes >= MAX_DESCARTES_SEGUIDOS:
+                    await websocket.close(code=1008)
+                    raise WebSocketDisconnect(1008)
+                continue
+            descartes = 0
+            try:
+                data = validar_mensaje(mensaje.get("text"), MAX_BYTES_MENSAJE)
+            except MensajeInvalido as e:
+                RECHAZOS.labels("invalido").inc()
+                conexion.enviar_json({"type": "error", "message": str(e)})
+                continue
+            action = data["action"]
+            if data.get("name") == NOMBRE_CPU:
+                conexion.enviar_json({"type": "error", "message": "Ese nombre está reservado"})
+                continue
+            if action == "resync" and admision.sobrecargado:
+                # Con el loop atrasado se posterga lo que el cliente puede reintentar
+                conexion.enviar_json({"type": "error", "message": "Servidor ocupado, reintenta"})
+                continue
+
+            with ACCION_SEGUNDOS.medir(action):
+                if action == "join":
+                    nombre_anterior = jugador_nombre
+                    jugador_nombre = data.get("name")
+                    if not jugador_nombre:
+                        conexion.enviar_json({"type": "error", "message": "Falta nombre."})
+                        continue
+
+                    token = secrets.token_urlsafe(16)
 
-                j_db = get_or_create_jugador(db, jugador_nombre)
-                db.add(Movimiento(
-                    partida_id=None,
-                    jugador_id=j_db.id,
-                    posicion=pos,
-                    turno=len([c for c in partida["board"] if c])
-                ))
-                db.commit()
-
-                if ganador:
-                    nombres = list(partida["jugadores"].keys())
-                    if len(nombres) == 2:
-                        j1 = get_or_create_jugador(db, nombres[0])
-                        j2 = get_or_create_jugador(db, nombres[1])
-                        p_db = Partida(
-                            jugador1_id=j1.id,
-                            jugador2_id=j2.id,
-                            fecha=datetime.utcnow()
-                        )
-                        if ganador == "Empate":
-                            p_db.ganador_id = None
-                        elif partida["jugadores"][nombres[0]]["symbol"] == ganador:
-                            p_db.ganador_id = j1.id
-                            j1.ganadas += 1
-                            j2.perdidas += 1
+                    def sentar(sala, registrar):
+                        ocupados = set(sala.asientos.values())
+                        if sala.asientos.get(jugador_nombre):
+                            if jugador_nombre in sala.reanudacion:
+                                # Su dueño está conectado, en gracia o es una reserva
+                                # del emparejamiento: solo se recupera con el token
+                                return None
+                            # Vuelve a su asiento (p. ej. sala recuperada tras reiniciar)
+                            nuevo = sala.asientos[jugador_nombre]
+                            sala.ausentes.pop(jugador_nombre, None)
                         else:
-                            p_db.ganador_id = j2.id
-                            j2.ganadas += 1
-                            j1.perdidas += 1
-                        db.add(p_db)
-                        db.commit()
-
-            elif action == "reset":
-                partida["board"] = ["" for _ in range(9)]
-                partida["turn"] = "X"
-                partida["ganador"] = None
-                for j, info in partida["jugadores"].items():
-                    await info["ws"].send_json({
-                        "type": "state",
-                        "board": partida["board"],
-                        "turn": partida["turn"],
-                        "winner": None
+                            if "X" not in ocupados:
+                                nuevo = "X"
+                            elif "O" not in ocupados:
+                                nuevo = "O"
+                            else:
+                                nuevo = None  # espectador
+                            sala.asientos[jugador_nombre] = nuevo
+                            registrar("join", nombre=jugador_nombre, simbolo=nuevo)
+                        if nuevo:
+                            sala.reanudacion[jugador_nombre] = digesto_token(token)
+                        return nuevo, mensaje_estado(sala)
+
+                    # Protocolo v2 (deltas) y codificación binaria se negocian aquí
+                    version = VERSION_ACTUAL if data.get("protocol") == VERSION_ACTUAL else 1
+                    conexion.formato = (version, version >= 2 and bool(data.get("binary")))
+
+                    sentado = await actualizar_sala(partida_id, sentar)
+                    if sentado is None:
+                        conexion.enviar_json({"type": "error", "message": "Ese asiento está reservado; usa resume con tu token"})
+                        jugador_nombre = nombre_anterior
+                        continue
+                    simbolo, estado = sentado
+                    desplazar_conexion(partida_id, jugador_nombre, conexion)
+                    cancelar_liberacion(partida_id, jugador_nombre)
+                    if simbolo:
+                        await registrar_jugador(jugador_nombre)
+
+                    conexion.enviar_json({
+                        "type": "info",
+                        "message": f"Conectado como {simbolo or 'Espectador'}",
+                        "symbol": simbolo,
+                        "protocol": version,
+                        # Con él, tras un corte, {"action": "resume"} recupera el asiento
+                        "resume_token": token if simbolo else None
                     })
+                    # Los clientes v2 solo reciben fotos al unirse ellos mismos
+                    if version >= 2:
+                        conexion.enviar(codificar(estado, *conexion.formato))
+                    await store.publicar(partida_id, {**estado, "solo_v1": True})
+
+                elif action == "resume":
+                    nombre = data["name"]
+                    digesto = digesto_token(data["token"])
+
+                    def reanudar(sala, registrar):
+                        if not secrets.compare_digest(sala.reanudacion.get(nombre, ""), digesto):
+                            return None
+                        sala.ausentes.pop(nombre, None)
+                        return sala.asientos.get(nombre), mensajes_perdidos(sala, data.get("seq"))
+
+                    reanudada = await actualizar_sala(partida_id, reanudar)
+                    if reanudada is None:
+                        # Venció la gracia o el token no es de esta sala: el cliente hace join
+                        REANUDACIONES.labels("rechazada").inc()
+                        conexion.enviar_json({"type": "error", "message": "Sesión expirada", "resume": False})
+                        continue
+                    REANUDACIONES.labels("ok").inc()
+                    jugador_nombre = nombre
+                    simbolo, perdidos = reanudada
+                    cancelar_liberacion(partida_id, nombre)
+                    if simbolo:
+                        # Reservas del emparejamiento: su primer ingreso es por resume
+                        await registrar_jugador(nombre)
+                    version = VERSION_ACTUAL if data.get("protocol") == VERSION_ACTUAL else 1
+                    conexion.formato = (version, version >= 2 and bool(data.get("binary")))
+                    desplazar_conexion(partida_id, nombre, conexion)
+
+                    conexion.enviar_json({
+                        "type": "info",
+                        "message": f"Reconectado como {simbolo or 'Espectador'}",
+                        "symbol": simbolo,
+                        "protocol": version,
+                        "resumed": True
+                    })
+                    for perdido in perdidos:
+                        conexion.enviar(codificar(perdido, *conexion.formato))
+
+                elif action == "resync":
+                    sala = await store.obtener(partida_id)
+                    if sala is None:
+                        conexion.enviar_json({"type": "error", "message": "La sala no existe"})
+                        continue
+                    conexion.enviar(codificar(mensaje_estado(sala), *conexion.formato))
+
+                elif action == "move":
+                    fases = Fases(recibido)
+                    fases.marcar("parse")
+                    pos = data.get("position")
+
+                    def jugar(sala, registrar):
+                        juego = sala.juego
+                        # El asiento se comprueba en la sala: el símbolo de este
+                        # socket puede ser viejo si otra conexión reanudó la sesión
+                        if (not simbolo or simbolo != juego.current_player
+                                or sala.asientos.get(jugador_nombre) != simbolo
+                                or conexiones.get(partida_id, {}).get(jugador_nombre) is not conexion):
+                            return None
+                        if pos is None or juego.winner:
+                            return []
+                        fases.marcar("validate")
+                        jugada = aplicar_jugada(sala, registrar, jugador_nombre, pos)
+                        if jugada is None:
+                            return []
+                        jugadas = [jugada]
+                        cpu = sala.cpu
+                        if cpu and solver_juega(juego) and not juego.winner and juego.current_player == cpu:
+                            jugadas.append(aplicar_jugada(sala, registrar, NOMBRE_CPU, solver.jugada_para(juego)))
+                        fases.marcar("mutate")
+                        return jugadas
+
+                    jugadas = await actualizar_sala(partida_id, jugar)
+                    if jugadas is None:
+                        conexion.enviar_json({"type": "error", "message": "No es tu turno"})
+                        continue
+                    if not jugadas:
+                        continue
+                    # Lo que quede entre "mutate" y aquí es encolar la bitácora
+                    fases.marcar("bitacora")
+                    for jugada in jugadas:
+                        await difundir_jugada(partida_id, jugada, fases)
+                    jugadas_lentas.revisar(partida_id, jugador_nombre, fases)
+
+                elif action == "reset":
+                    def reiniciar(sala, registrar):
+                        sala.juego.reset()
+                        sala.jugadas = []
+                        sala.recientes = []
+                        sala.seq += 1
+                        registrar("reset")
+                        return mensaje_estado(sala)
+
+                    await store.publicar(partida_id, await actualizar_sala(partida_id, reiniciar))
 
     except WebSocketDisconnect:
-        if jugador_nombre and jugador_nombre in partida["jugadores"]:
-            del partida["jugadores"][jugador_nombre]
+        pass
+    finally:
+        # Corre también si el manejador falló: si no, la tarea de envío queda
+        # viva y la sala sigue marcada en uso (nunca expira)
+        try:
+            await soltar_socket(partida_id, jugador_nombre, simbolo, conexion)
+        finally:
+            SOCKETS_CONECTADOS.dec()
+            admision.liberar(ip)
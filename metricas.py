@@ -0,0 +1,201 @@
+# metricas.py
+"""Métricas en formato de texto de Prometheus, sin dependencias.
+
+Contadores, medidores e histogramas con etiquetas opcionales. Se actualizan
+solo desde el event loop (sin locks) y `exponer()` genera el texto para
+/metrics. Las tasas por segundo (mensajes, jugadas) se obtienen en
+Prometheus con `rate()` sobre los contadores.
+"""
+import bisect
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Segundos: de 100 µs a 5 s
+BUCKETS_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_TAMANO = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+_registro: List["_Metrica"] = []
+
+
+def _formatear(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{n}="{v}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica(ABC):
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._hijos: Dict[Tuple[str, ...], object] = {}
+        _registro.append(self)
+
+    @abstractmethod
+    def _hijo(self, valores: Tuple[str, ...]):
+        ...
+
+    def labels(self, *valores) -> "_Metrica":
+        clave = tuple(str(v) for v in valores)
+        hijo = self._hijos.get(clave)
+        if hijo is None:
+            hijo = self._hijos[clave] = self._hijo(clave)
+        return hijo
+
+    @abstractmethod
+    def _muestras(self) -> List[str]:
+        ...
+
+    def exponer(self) -> str:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        lineas.extend(self._muestras())
+        return "\n".join(lineas)
+
+
+class _Valor:
+    __slots__ = ("valor",)
+
+    def __init__(self):
+        self.valor = 0
+
+    def inc(self, cantidad: float = 1):
+        self.valor += cantidad
+
+    def dec(self, cantidad: float = 1):
+        self.valor -= cantidad
+
+    def set(self, valor: float):
+        self.valor = valor
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._sin_etiquetas = _Valor()
+
+    def _hijo(self, valores):
+        return _Valor()
+
+    def inc(self, cantidad: float = 1):
+        self._sin_etiquetas.inc(cantidad)
+
+    def _muestras(self):
+        if not self.etiquetas:
+            return [f"{self.nombre} {_formatear(self._sin_etiquetas.valor)}"]
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_formatear(h.valor)}"
+                for k, h in sorted(self._hijos.items())]
+
+
+class Medidor(Contador):
+    tipo = "gauge"
+
+    def set(self, valor: float):
+        self._sin_etiquetas.set(valor)
+
+    def dec(self, cantidad: float = 1):
+        self._sin_etiquetas.dec(cantidad)
+
+
+class _Distribucion:
+    __slots__ = ("limites", "cuentas", "suma")
+
+    def __init__(self, limites: Tuple[float, ...]):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+
+    def observe(self, valor: float):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                 buckets: Sequence[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._sin_etiquetas = _Distribucion(self.buckets)
+
+    def _hijo(self, valores):
+        return _Distribucion(self.buckets)
+
+    def observe(self, valor: float):
+        self._sin_etiquetas.observe(valor)
+
+    @contextmanager
+    def medir(self, *valores):
+        """Observa la duración del bloque en segundos."""
+        destino = self.labels(*valores) if valores else self._sin_etiquetas
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            destino.observe(time.perf_counter() - inicio)
+
+    def _muestras(self):
+        series = sorted(self._hijos.items()) if self.etiquetas else [((), self._sin_etiquetas)]
+        lineas = []
+        for valores, dist in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets + (float("inf"),), dist.cuentas):
+                acumulado += cuenta
+                le = _etiquetas(self.etiquetas, valores, f'le="{_formatear(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            base = _etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{base} {_formatear(dist.suma)}")
+            lineas.append(f"{self.nombre}_count{base} {acumulado}")
+        return lineas
+
+
+def exponer(metricas: Optional[List[_Metrica]] = None) -> str:
+    """Texto de exposición de todas las métricas registradas."""
+    return "\n".join(m.exponer() for m in (metricas or _registro)) + "\n"
+
+
+# ======================
+#   MÉTRICAS DEL SERVIDOR
+# ======================
+
+ACCION_SEGUNDOS = Histograma(
+    "triki_ws_accion_segundos", "Duración de cada acción del WebSocket", ["accion"])
+MENSAJES_ENTRANTES = Contador(
+    "triki_ws_mensajes_entrantes_total", "Mensajes recibidos por los WebSockets")
+MENSAJES_SALIENTES = Contador(
+    "triki_ws_mensajes_salientes_total", "Mensajes encolados hacia los WebSockets")
+SOCKETS_CONECTADOS = Medidor(
+    "triki_ws_conectados", "WebSockets abiertos en este worker")
+DIFUSION_DESTINOS = Histograma(
+    "triki_difusion_destinos", "Sockets locales alcanzados por cada mensaje publicado",
+    buckets=BUCKETS_TAMANO)
+DIFUSION_SEGUNDOS = Histograma(
+    "triki_difusion_segundos", "Tiempo de codificar y encolar un mensaje publicado")
+LOTE_SEGUNDOS = Histograma(
+    "triki_persistencia_lote_segundos", "Duración de escribir y confirmar un lote en la base")
+LOTE_TAMANO = Histograma(
+    "triki_persistencia_lote_elementos", "Elementos por lote de persistencia",
+    buckets=BUCKETS_TAMANO)
+SALAS_VIVAS = Medidor("triki_salas_vivas", "Salas en el store")
+PERSISTENCIA_PENDIENTES = Medidor(
+    "triki_persistencia_pendientes", "Elementos esperando en la cola de persistencia")
+DESCARTADOS = Contador(
+    "triki_ws_descartados_total", "Mensajes descartados por cola de envío llena")
+DESCONECTADOS_LENTOS = Contador(
+    "triki_ws_desconectados_lentos_total", "Clientes desconectados por no leer a tiempo")
+REANUDACIONES = Contador(
+    "triki_ws_reanudaciones_total", "Reconexiones con token de reanudación", ["resultado"])
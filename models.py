@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -18,12 +18,18 @@ class Jugador(Base):
 
 class Partida(Base):
     __tablename__ = "partidas"
+    # Paginación por cursor (fecha, id) en /api/historico
+    __table_args__ = (Index("ix_partidas_fecha_id", "fecha", "id"),)
     id = Column(Integer, primary_key=True, index=True)
-    jugador1_id = Column(Integer, ForeignKey("jugadores.id"))
-    jugador2_id = Column(Integer, ForeignKey("jugadores.id"))
+    jugador1_id = Column(Integer, ForeignKey("jugadores.id"), index=True)
+    jugador2_id = Column(Integer, ForeignKey("jugadores.id"), index=True)
     ganador_id = Column(Integer, ForeignKey("jugadores.id"), nullable=True)
     fecha = Column(DateTime, default=datetime.utcnow)
     duracion_seg = Column(Integer, nullable=True)
+    # ID de la sala (el que usa /ws/{partida_id}) para enlazar con la bitácora
+    codigo = Column(String, nullable=True, index=True)
+    tamano = Column(Integer, nullable=True)
+    en_linea = Column(Integer, nullable=True)
 
     jugador1 = relationship("Jugador", foreign_keys=[jugador1_id], back_populates="partidas")
     jugador2 = relationship("Jugador", foreign_keys=[jugador2_id], back_populates="partidas2")
@@ -34,10 +40,32 @@ class Partida(Base):
 class Movimiento(Base):
     __tablename__ = "movimientos"
     id = Column(Integer, primary_key=True, index=True)
-    partida_id = Column(Integer, ForeignKey("partidas.id"))
+    partida_id = Column(Integer, ForeignKey("partidas.id"), index=True)
     jugador_id = Column(Integer, ForeignKey("jugadores.id"))
-    posicion = Column(Integer)  # 0–8 (celda del tablero)
+    posicion = Column(Integer)  # fila * tamaño + columna (0–8 en el 3×3)
     turno = Column(Integer)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-    partida = relationship("Partida", back_populates="movimientos")
\ No newline at end of file
+    partida = relationship("Partida", back_populates="movimientos")
+
+
+class EventoPartida(Base):
+    """Bitácora de solo-anexar: create, join, leave, move, reset, finish."""
+    __tablename__ = "eventos_partida"
+    __table_args__ = (UniqueConstraint("codigo", "num", name="uq_evento_codigo_num"),)
+    id = Column(Integer, primary_key=True)
+    codigo = Column(String, index=True)
+    num = Column(Integer)
+    tipo = Column(String)
+    datos = Column(Text)  # JSON
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+
+class SnapshotPartida(Base):
+    """Estado completo de la sala tras el evento `num`, para acotar el replay."""
+    __tablename__ = "snapshots_partida"
+    id = Column(Integer, primary_key=True)
+    codigo = Column(String, index=True)
+    num = Column(Integer)
+    estado = Column(Text)  # JSON de store.Sala.to_dict()
+    timestamp = Column(DateTime, default=datetime.utcnow)
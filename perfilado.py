@@ -0,0 +1,100 @@
+# perfilado.py
+"""Diagnóstico en producción sin reiniciar el servidor.
+
+`PerfiladorMuestreo` toma cada pocos milisegundos la pila de todos los hilos
+con `sys._current_frames()` desde un hilo aparte, así el costo para el event
+loop es casi nulo. El resultado sale en formato "collapsed stacks" (una
+línea `marco;marco;marco cuenta` por pila), el que leen flamegraph.pl y
+speedscope.
+
+`Fases` cronometra las etapas de una jugada y `RegistroLento` guarda las que
+superan un umbral, con el tiempo de cada etapa.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PerfiladorMuestreo:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self) -> bool:
+        return self._lock.locked()
+
+    def muestrear(self, segundos: float, intervalo: float = 0.005) -> str:
+        """Muestrea durante `segundos` (bloquea: llamar en un hilo). Devuelve las pilas colapsadas."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Ya hay un perfilado en curso")
+        try:
+            propio = threading.get_ident()
+            pilas: Counter = Counter()
+            fin = time.monotonic() + segundos
+            while time.monotonic() < fin:
+                nombres = {t.ident: t.name for t in threading.enumerate()}
+                for ident, marco in sys._current_frames().items():
+                    if ident == propio:
+                        continue
+                    pila = []
+                    while marco is not None:
+                        codigo = marco.f_code
+                        pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                        marco = marco.f_back
+                    pila.append(nombres.get(ident, f"hilo-{ident}"))
+                    pilas[";".join(reversed(pila))] += 1
+                time.sleep(intervalo)
+        finally:
+            self._lock.release()
+        return "".join(f"{pila} {cuenta}\n" for pila, cuenta in pilas.most_common())
+
+
+class Fases:
+    """Tiempos por etapa de una jugada, en milisegundos."""
+    __slots__ = ("inicio", "_ultimo", "tiempos")
+
+    def __init__(self, inicio: Optional[float] = None):
+        self.inicio = self._ultimo = inicio if inicio is not None else time.perf_counter()
+        self.tiempos: Dict[str, float] = {}
+
+    def marcar(self, fase: str):
+        ahora = time.perf_counter()
+        self.tiempos[fase] = self.tiempos.get(fase, 0.0) + (ahora - self._ultimo) * 1000
+        self._ultimo = ahora
+
+    @property
+    def total_ms(self) -> float:
+        return (self._ultimo - self.inicio) * 1000
+
+
+class RegistroLento:
+    def __init__(self, umbral_ms: float, max_entradas: int = 200):
+        self.umbral_ms = umbral_ms
+        self._entradas: deque = deque(maxlen=max_entradas)
+        self.total = 0
+
+    def revisar(self, partida_id: str, jugador: Optional[str], fases: Fases):
+        """Guarda y registra en el log la jugada si superó el umbral."""
+        total = fases.total_ms
+        if total < self.umbral_ms:
+            return
+        self.total += 1
+        detalle = {fase: round(ms, 3) for fase, ms in fases.tiempos.items()}
+        self._entradas.append({
+            "partida_id": partida_id,
+            "jugador": jugador,
+            "fecha": time.time(),
+            "total_ms": round(total, 3),
+            "fases_ms": detalle,
+        })
+        logger.warning("Jugada lenta en %s (%s): %.1f ms %s", partida_id, jugador, total,
+                       " ".join(f"{fase}={ms:.1f}" for fase, ms in detalle.items()))
+
+    def recientes(self) -> List[dict]:
+        return list(reversed(self._entradas))
@@ -0,0 +1,231 @@
+# persistence.py
+"""Persistencia diferida (write-behind) de partidas y de la bitácora de eventos.
+
+El WebSocket solo encola; una tarea en segundo plano agrupa los pendientes
+en lotes (máximo `max_lote` elementos o `intervalo_ms` de espera) y los
+escribe por una sesión async (aiosqlite) con una sola transacción por lote,
+así la latencia de SQLite nunca bloquea el event loop.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from identidades import CacheJugadores
+from leaderboard import calcular_puntaje
+from metricas import LOTE_SEGUNDOS, LOTE_TAMANO
+from models import EventoPartida, Jugador, Movimiento, Partida, SnapshotPartida
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()
+
+
+class ColaPersistencia:
+    def __init__(self, session_factory, jugadores: CacheJugadores, max_lote: int = 500,
+                 intervalo_ms: int = 50, max_pendientes: int = 10000):
+        self.session_factory = session_factory
+        self.jugadores = jugadores
+        self.max_lote = max_lote
+        self.intervalo = intervalo_ms / 1000
+        self.max_pendientes = max_pendientes
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+        # codigo -> número del último evento encolado que aún no se escribió
+        self._eventos_pendientes: Dict[str, int] = {}
+        self._stats = {
+            "encolados": 0,
+            "escritos": 0,
+            "lotes": 0,
+            "errores": 0,
+            "esperas_cola_llena": 0,
+            "max_pendientes_visto": 0,
+            "ultimo_lote_ms": 0.0,
+        }
+
+    async def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+        self._tarea = asyncio.create_task(self._trabajar())
+
+    async def detener(self):
+        """Vacía la cola y espera a que se escriba el último lote."""
+        if self._tarea is None:
+            return
+        await self._cola.put(_FIN)
+        await self._tarea
+        self._tarea = None
+
+    async def _encolar(self, elemento: dict):
+        if self._cola.full():
+            # Contrapresión: quien juega espera a que se libere espacio
+            self._stats["esperas_cola_llena"] += 1
+        await self._cola.put(elemento)
+        self._stats["encolados"] += 1
+        self._stats["max_pendientes_visto"] = max(self._stats["max_pendientes_visto"], self._cola.qsize())
+
+    async def encolar_eventos(self, codigo: str, pendientes: List[dict]):
+        """Encola lo que devuelve eventlog.registrar (eventos y snapshots)."""
+        ahora = datetime.utcnow()
+        self._eventos_pendientes[codigo] = max(
+            self._eventos_pendientes.get(codigo, 0), max(p["num"] for p in pendientes))
+        for p in pendientes:
+            await self._encolar({**p, "codigo": codigo, "timestamp": ahora,
+                                 "tipo": "snapshot" if p["tipo"] == "snapshot" else "evento",
+                                 "evento": p["tipo"]})
+
+    async def encolar_partida(self, codigo: str, tamano: int, en_linea: int,
+                              jugador1: Optional[str], jugador2: Optional[str],
+                              ganador: Optional[str], jugadas: List[list]):
+        """Registra una partida terminada con sus jugadas [nombre, posición, timestamp].
+
+        `ganador` es un nombre o None si hubo empate. Si falta alguno de los
+        dos jugadores solo se guardan las jugadas, sin fila en Partida.
+        """
+        await self._encolar({
+            "tipo": "partida",
+            "codigo": codigo,
+            "tamano": tamano,
+            "en_linea": en_linea,
+            "jugador1": jugador1,
+            "jugador2": jugador2,
+            "ganador": ganador,
+            "jugadas": [list(j) for j in jugadas],
+            "fecha": datetime.utcnow(),
+        })
+
+    def ultimo_evento_pendiente(self, codigo: str) -> int:
+        return self._eventos_pendientes.get(codigo, 0)
+
+    def _olvidar_eventos(self, lote):
+        for e in lote:
+            if e["tipo"] != "partida" and self._eventos_pendientes.get(e["codigo"]) == e["num"]:
+                del self._eventos_pendientes[e["codigo"]]
+
+    def metricas(self) -> dict:
+        return {**self._stats, "pendientes": self._cola.qsize() if self._cola else 0}
+
+    async def _trabajar(self):
+        terminar = False
+        while not terminar:
+            primero = await self._cola.get()
+            if primero is _FIN:
+                break
+            lote = [primero]
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                try:
+                    if restante > 0:
+                        elemento = await asyncio.wait_for(self._cola.get(), restante)
+                    else:
+                        elemento = self._cola.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if elemento is _FIN:
+                    terminar = True
+                    break
+                lote.append(elemento)
+
+            inicio = time.perf_counter()
+            try:
+                await self._escribir(lote)
+                self._stats["escritos"] += len(lote)
+            except Exception:
+                if len(lote) == 1:
+                    self._stats["errores"] += 1
+                    logger.exception("No se pudo escribir %s de %s", lote[0]["tipo"], lote[0]["codigo"])
+                else:
+                    # Un elemento malo no debe tirar el resto del lote: se reintenta de a uno
+                    logger.warning("Falló un lote de %d elementos; se reintenta uno por uno", len(lote))
+                    await self._escribir_por_separado(lote)
+            self._olvidar_eventos(lote)
+            duracion = time.perf_counter() - inicio
+            self._stats["lotes"] += 1
+            self._stats["ultimo_lote_ms"] = duracion * 1000
+            LOTE_SEGUNDOS.observe(duracion)
+            LOTE_TAMANO.observe(len(lote))
+
+    async def _escribir_por_separado(self, lote):
+        for elemento in lote:
+            try:
+                await self._escribir([elemento])
+                self._stats["escritos"] += 1
+            except Exception:
+                self._stats["errores"] += 1
+                logger.exception("No se pudo escribir %s de %s", elemento["tipo"], elemento["codigo"])
+
+    async def _escribir(self, lote):
+        async with self.session_factory() as db:
+            partidas = [e for e in lote if e["tipo"] == "partida"]
+            nombres = set()
+            for e in partidas:
+                nombres.update(n for n in (e["jugador1"], e["jugador2"]) if n)
+                nombres.update(j[0] for j in e["jugadas"])
+
+            try:
+                ids = await self.jugadores.resolver(db, nombres)
+
+                # Victorias y derrotas acumuladas del lote por jugador
+                resultados = {}
+                filas_partida = []
+                for e in partidas:
+                    p_db = None
+                    if e["jugador1"] and e["jugador2"]:
+                        j1, j2 = e["jugador1"], e["jugador2"]
+                        p_db = Partida(jugador1_id=ids[j1], jugador2_id=ids[j2], fecha=e["fecha"],
+                                       codigo=e["codigo"], tamano=e["tamano"], en_linea=e["en_linea"])
+                        if e["jugadas"]:
+                            p_db.duracion_seg = int(e["jugadas"][-1][2] - e["jugadas"][0][2])
+                        for nombre in (j1, j2):
+                            resultados.setdefault(nombre, [0, 0])
+                        if e["ganador"] in (j1, j2):
+                            perdedor = j2 if e["ganador"] == j1 else j1
+                            p_db.ganador_id = ids[e["ganador"]]
+                            resultados[e["ganador"]][0] += 1
+                            resultados[perdedor][1] += 1
+                        db.add(p_db)
+                    filas_partida.append((e, p_db))
+                await db.flush()
+
+                for nombre, (ganadas, perdidas) in resultados.items():
+                    if ganadas or perdidas:
+                        total_g, total_p = Jugador.ganadas + ganadas, Jugador.perdidas + perdidas
+                        await db.execute(
+                            update(Jugador).where(Jugador.id == ids[nombre])
+                            .values(ganadas=total_g, perdidas=total_p, puntaje=calcular_puntaje(total_g, total_p))
+                        )
+
+                movimientos = [
+                    {
+                        "partida_id": p_db.id if p_db else None,
+                        "jugador_id": ids[nombre],
+                        "posicion": posicion,
+                        "turno": turno,
+                        "timestamp": datetime.utcfromtimestamp(ts),
+                    }
+                    for e, p_db in filas_partida
+                    for turno, (nombre, posicion, ts) in enumerate(e["jugadas"], 1)
+                ]
+                eventos = [
+                    {"codigo": e["codigo"], "num": e["num"], "tipo": e["evento"],
+                     "datos": e["datos"], "timestamp": e["timestamp"]}
+                    for e in lote if e["tipo"] == "evento"
+                ]
+                snapshots = [
+                    {"codigo": e["codigo"], "num": e["num"], "estado": e["estado"], "timestamp": e["timestamp"]}
+                    for e in lote if e["tipo"] == "snapshot"
+                ]
+                if movimientos:
+                    await db.execute(insert(Movimiento), movimientos)
+                if eventos:
+                    await db.execute(insert(EventoPartida), eventos)
+                if snapshots:
+                    await db.execute(insert(SnapshotPartida), snapshots)
+                await db.commit()
+            except Exception:
+                # Los ids insertados en esta transacción no llegaron a existir
+                self.jugadores.invalidar(nombres)
+                raise
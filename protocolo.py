@@ -0,0 +1,95 @@
+# protocolo.py
+"""Codificación de los mensajes de sala hacia los clientes.
+
+Internamente cada mensaje publicado lleva los bitboards y un número de
+secuencia por sala. Cada cliente elige al hacer `join` cómo recibirlo:
+
+v1 (por defecto): JSON con el tablero completo, como siempre.
+v2 JSON:   jugadas como deltas {"t": "m", "seq", "pos", "sym", "winner"} y
+           fotos completas {"t": "s", ...} solo al unirse, reiniciar o
+           pedir `resync`.
+v2 binario: los mismos mensajes empaquetados con `struct`:
+    jugada  !BIHBB  tipo=1, seq, pos, símbolo, ganador
+    foto    !BIBBBB tipo=2, seq, tamaño, en_línea, turno, ganador
+            + un byte por casilla (0 vacía, 1 X, 2 O)
+"""
+import json
+import struct
+from typing import Union
+
+from game_logic import bits_to_board
+
+VERSION_ACTUAL = 2
+
+_JUGADA = struct.Struct("!BIHBB")
+_FOTO = struct.Struct("!BIBBBB")
+TIPO_JUGADA = 1
+TIPO_FOTO = 2
+
+# Códigos de símbolo/ganador en binario
+_CODIGOS = {None: 0, "X": 1, "O": 2, "Empate": 3}
+
+
+def _tablero(mensaje: dict) -> list:
+    return bits_to_board(mensaje["x"], mensaje["o"], mensaje["size"] ** 2)
+
+
+def _v1(mensaje: dict) -> str:
+    if mensaje["type"] == "state":
+        return json.dumps({
+            "type": "state",
+            "board": _tablero(mensaje),
+            "size": mensaje["size"],
+            "win_length": mensaje["win_length"],
+            "turn": mensaje["turn"],
+            "winner": mensaje["winner"],
+        })
+    return json.dumps({
+        "type": "move_result",
+        "board": _tablero(mensaje),
+        "turn": mensaje["turn"],
+        "winner": mensaje["winner"],
+    })
+
+
+def _v2_json(mensaje: dict) -> str:
+    if mensaje["type"] == "state":
+        return json.dumps({
+            "t": "s",
+            "seq": mensaje["seq"],
+            "size": mensaje["size"],
+            "win_length": mensaje["win_length"],
+            "board": "".join(c or "." for c in _tablero(mensaje)),
+            "turn": mensaje["turn"],
+            "winner": mensaje["winner"],
+        })
+    return json.dumps({
+        "t": "m",
+        "seq": mensaje["seq"],
+        "pos": mensaje["pos"],
+        "sym": mensaje["sym"],
+        "winner": mensaje["winner"],
+    })
+
+
+def _v2_binario(mensaje: dict) -> bytes:
+    if mensaje["type"] == "state":
+        x, o = mensaje["x"], mensaje["o"]
+        celdas = bytes(1 if x >> i & 1 else 2 if o >> i & 1 else 0 for i in range(mensaje["size"] ** 2))
+        return _FOTO.pack(
+            TIPO_FOTO, mensaje["seq"], mensaje["size"], mensaje["win_length"],
+            _CODIGOS[mensaje["turn"]], _CODIGOS[mensaje["winner"]],
+        ) + celdas
+    return _JUGADA.pack(
+        TIPO_JUGADA, mensaje["seq"], mensaje["pos"],
+        _CODIGOS[mensaje["sym"]], _CODIGOS[mensaje["winner"]],
+    )
+
+
+def codificar(mensaje: dict, version: int = 1, binario: bool = False) -> Union[str, bytes]:
+    """Codifica un mensaje de sala ("state" o "move_result") para un cliente."""
+    if version < 2:
+        return _v1(mensaje)
+    if binario:
+        return _v2_binario(mensaje)
+    return _v2_json(mensaje)
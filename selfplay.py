@@ -0,0 +1,260 @@
+# selfplay.py
+"""Motor de autojuego: millones de partidas entre políticas en paralelo.
+
+Las partidas se reparten en bloques de `--bloque` entre los procesos de un
+ProcessPoolExecutor. Cada bloque juega con su propia semilla (resultados
+reproducibles) y devuelve solo los acumulados: resultados, histograma de
+largos y, si se va a guardar, las jugadas empaquetadas en bytes. El proceso
+principal suma los bloques a medida que terminan.
+
+Políticas:
+    random    casilla libre al azar
+    greedy    gana si puede, si no bloquea, si no centro o al azar
+    perfect   solver minimax precalculado (solo 3×3)
+
+Uso:
+    python selfplay.py --partidas 1000000 --x random --o perfect
+    python selfplay.py --partidas 200000 --x greedy --o random --guardar
+        (--guardar escribe en TRIKI_DATABASE_URL; mejor con el servidor detenido,
+         que además carga la clasificación solo al arrancar)
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+
+import solver
+from database import Base, SessionLocal, engine
+from game_logic import TrikiGame, _GANA, line_through
+from leaderboard import calcular_puntaje
+from models import Jugador, Movimiento, Partida
+
+POLITICAS = ("random", "greedy", "perfect")
+RESULTADOS = {"X": 0, "O": 1, "Empate": 2}
+
+
+# ======================
+#   POLÍTICAS
+# ======================
+
+def _libres(juego: TrikiGame) -> List[int]:
+    libres = juego.legal_moves()
+    return [i for i in range(juego.cells) if libres >> i & 1]
+
+
+def jugar_random(juego: TrikiGame, rng: random.Random) -> int:
+    return rng.choice(_libres(juego))
+
+
+def jugar_greedy(juego: TrikiGame, rng: random.Random) -> int:
+    libres = _libres(juego)
+    propias, rivales = ((juego.x_bits, juego.o_bits) if juego.current_player == "X"
+                        else (juego.o_bits, juego.x_bits))
+    en_3x3 = juego.size == 3 and juego.win_length == 3
+    for bits in (propias, rivales):
+        for pos in libres:
+            con = bits | 1 << pos
+            if _GANA[con] if en_3x3 else line_through(con, pos, juego.size, juego.win_length):
+                return pos
+    centro = juego.cells // 2
+    if juego.size % 2 and centro in libres:
+        return centro
+    return rng.choice(libres)
+
+
+def jugar_perfect(juego: TrikiGame, rng: random.Random) -> int:
+    return solver.jugada_para(juego)
+
+
+JUGAR: Dict[str, Callable[[TrikiGame, random.Random], int]] = {
+    "random": jugar_random,
+    "greedy": jugar_greedy,
+    "perfect": jugar_perfect,
+}
+
+
+# ======================
+#   TRABAJO POR BLOQUE
+# ======================
+
+def _iniciar_proceso(politicas: Tuple[str, str]):
+    if "perfect" in politicas:
+        solver.precalcular()
+
+
+def jugar_bloque(partidas: int, semilla: int, politica_x: str, politica_o: str,
+                 tamano: int, en_linea: int, guardar_jugadas: bool) -> dict:
+    """Juega `partidas` y devuelve los acumulados del bloque (se ejecuta en un worker)."""
+    rng = random.Random(semilla)
+    jugar_x, jugar_o = JUGAR[politica_x], JUGAR[politica_o]
+    resultados = [0, 0, 0]
+    largos = [0] * (tamano * tamano + 1)
+    jugadas: Optional[List[Tuple[int, bytes]]] = [] if guardar_jugadas else None
+    juego = TrikiGame(tamano, en_linea)
+
+    for _ in range(partidas):
+        juego.reset()
+        secuencia = array("H")
+        while not juego.winner:
+            pos = (jugar_x if juego.current_player == "X" else jugar_o)(juego, rng)
+            juego.make_move(pos)
+            secuencia.append(pos)
+        resultado = RESULTADOS[juego.winner]
+        resultados[resultado] += 1
+        largos[len(secuencia)] += 1
+        if jugadas is not None:
+            jugadas.append((resultado, secuencia.tobytes()))
+
+    return {"resultados": resultados, "largos": largos, "jugadas": jugadas}
+
+
+def bloques(total: int, tamano_bloque: int):
+    for inicio in range(0, total, tamano_bloque):
+        yield min(tamano_bloque, total - inicio)
+
+
+# ======================
+#   CARGA MASIVA
+# ======================
+
+class CargaMasiva:
+    """Inserta partidas autojugadas en Partida/Movimiento con ids asignados por lote."""
+
+    def __init__(self, politica_x: str, politica_o: str, tamano: int, en_linea: int):
+        Base.metadata.create_all(bind=engine)
+        self.db = SessionLocal()
+        self.tamano, self.en_linea = tamano, en_linea
+        self.nombres = (f"bot-{politica_x}-x", f"bot-{politica_o}-o")
+        ids = []
+        for nombre in self.nombres:
+            jugador = self.db.execute(select(Jugador).where(Jugador.nombre == nombre)).scalar_one_or_none()
+            if jugador is None:
+                jugador = Jugador(nombre=nombre, ganadas=0, perdidas=0, puntaje=0)
+                self.db.add(jugador)
+                self.db.flush()
+            ids.append(jugador.id)
+        self.jugador_ids = tuple(ids)
+        self.siguiente_id = (self.db.execute(select(func.max(Partida.id))).scalar() or 0) + 1
+        self.ganadas = [0, 0]
+        self.fecha = datetime.utcnow()
+
+    def agregar(self, jugadas: List[Tuple[int, bytes]]):
+        j1, j2 = self.jugador_ids
+        partidas, movimientos = [], []
+        for resultado, datos in jugadas:
+            pid = self.siguiente_id
+            self.siguiente_id += 1
+            secuencia = array("H")
+            secuencia.frombytes(datos)
+            ganador = (j1, j2, None)[resultado]
+            if resultado < 2:
+                self.ganadas[resultado] += 1
+            partidas.append({
+                "id": pid, "jugador1_id": j1, "jugador2_id": j2, "ganador_id": ganador,
+                "fecha": self.fecha, "duracion_seg": 0, "codigo": f"self{pid:x}",
+                "tamano": self.tamano, "en_linea": self.en_linea,
+            })
+            movimientos.extend(
+                {"partida_id": pid, "jugador_id": j1 if turno % 2 else j2, "posicion": pos,
+                 "turno": turno, "timestamp": self.fecha + timedelta(milliseconds=turno)}
+                for turno, pos in enumerate(secuencia, 1)
+            )
+        self.db.execute(insert(Partida), partidas)
+        self.db.execute(insert(Movimiento), movimientos)
+        self.db.commit()
+
+    def terminar(self):
+        gx, go = self.ganadas
+        for jugador_id, ganadas, perdidas in ((self.jugador_ids[0], gx, go), (self.jugador_ids[1], go, gx)):
+            total_g, total_p = Jugador.ganadas + ganadas, Jugador.perdidas + perdidas
+            self.db.execute(
+                update(Jugador).where(Jugador.id == jugador_id)
+                .values(ganadas=total_g, perdidas=total_p, puntaje=calcular_puntaje(total_g, total_p))
+            )
+        self.db.commit()
+        self.db.close()
+
+
+# ======================
+#   CLI
+# ======================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--partidas", type=int, default=100000)
+    parser.add_argument("--x", choices=POLITICAS, default="random", help="política de X")
+    parser.add_argument("--o", choices=POLITICAS, default="random", help="política de O")
+    parser.add_argument("--tamano", type=int, default=3)
+    parser.add_argument("--en-linea", type=int, default=3)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bloque", type=int, default=20000, help="partidas por tarea")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--guardar", action="store_true",
+                        help="cargar las partidas en Partida/Movimiento")
+    parser.add_argument("--salida", help="archivo donde guardar el resumen JSON")
+    args = parser.parse_args(argv)
+
+    if "perfect" in (args.x, args.o) and (args.tamano, args.en_linea) != (3, 3):
+        parser.error("la política perfect solo juega en tableros 3×3")
+    TrikiGame(args.tamano, args.en_linea)  # valida las dimensiones antes de lanzar procesos
+
+    carga = CargaMasiva(args.x, args.o, args.tamano, args.en_linea) if args.guardar else None
+    celdas = args.tamano * args.tamano
+    resultados, largos = [0, 0, 0], [0] * (celdas + 1)
+    inicio = time.perf_counter()
+
+    with ProcessPoolExecutor(args.procesos, initializer=_iniciar_proceso,
+                             initargs=((args.x, args.o),)) as pool:
+        futuros = [
+            pool.submit(jugar_bloque, n, args.semilla * 1_000_003 + i, args.x, args.o,
+                        args.tamano, args.en_linea, args.guardar)
+            for i, n in enumerate(bloques(args.partidas, args.bloque))
+        ]
+        for futuro in as_completed(futuros):
+            bloque = futuro.result()
+            resultados = [a + b for a, b in zip(resultados, bloque["resultados"])]
+            largos = [a + b for a, b in zip(largos, bloque["largos"])]
+            if carga:
+                carga.agregar(bloque["jugadas"])
+
+    if carga:
+        carga.terminar()
+
+    duracion = time.perf_counter() - inicio
+    total = sum(resultados)
+    resumen = {
+        "partidas": total,
+        "x": args.x,
+        "o": args.o,
+        "tamano": args.tamano,
+        "en_linea": args.en_linea,
+        "gana_x": resultados[0],
+        "gana_o": resultados[1],
+        "empates": resultados[2],
+        "tasa_x": round(resultados[0] / total, 4) if total else None,
+        "tasa_o": round(resultados[1] / total, 4) if total else None,
+        "tasa_empate": round(resultados[2] / total, 4) if total else None,
+        "largo_medio": round(sum(n * k for n, k in enumerate(largos)) / total, 3) if total else None,
+        "procesos": args.procesos,
+        "duracion_seg": round(duracion, 3),
+        "partidas_por_seg": round(total / duracion, 1) if duracion else None,
+        "guardadas": bool(carga),
+    }
+    texto = json.dumps(resumen, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
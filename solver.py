@@ -0,0 +1,173 @@
+# solver.py
+"""Jugador perfecto para el Triki 3×3.
+
+La búsqueda es un negamax con poda alfa-beta y tabla de transposición
+indexada por el tablero canónico (se pliegan las 8 simetrías del cuadrado).
+Al arrancar el servidor se resuelven todas las posiciones alcanzables y se
+guarda la mejor jugada de cada una en un arreglo de 2^18 bytes, de modo que
+responder una jugada de la CPU es una sola consulta al arreglo.
+"""
+from typing import Dict, List, Tuple
+
+from game_logic import TABLERO_LLENO, TrikiGame, _GANA
+
+# Permutaciones del tablero: la casilla i pasa a SIMETRIAS[s][i]
+_ROTAR = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+_REFLEJAR = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _componer(p: Tuple[int, ...], q: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Aplica p y luego q."""
+    return tuple(q[p[i]] for i in range(9))
+
+
+def _generar_simetrias() -> List[Tuple[int, ...]]:
+    simetrias = []
+    actual = tuple(range(9))
+    for _ in range(4):
+        simetrias.append(actual)
+        simetrias.append(_componer(actual, _REFLEJAR))
+        actual = _componer(actual, _ROTAR)
+    return simetrias
+
+
+SIMETRIAS = _generar_simetrias()
+
+# _TRANSFORMAR[s][bits] = bits transformados por la simetría s
+_TRANSFORMAR = [
+    tuple(
+        sum(1 << perm[i] for i in range(9) if bits >> i & 1)
+        for bits in range(TABLERO_LLENO + 1)
+    )
+    for perm in SIMETRIAS
+]
+
+# Orden de exploración: centro, esquinas y bordes (mejora la poda)
+_ORDEN = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+
+_EXACTO, _COTA_INF, _COTA_SUP = 0, 1, 2
+_SIN_JUGADA = 0xFF
+
+_transposicion: Dict[int, Tuple[int, int]] = {}
+_tabla = bytearray()
+
+
+def clave_canonica(propias: int, rivales: int) -> Tuple[int, int]:
+    """Devuelve (clave canónica, índice de la simetría usada)."""
+    mejor, mejor_s = -1, 0
+    for s, t in enumerate(_TRANSFORMAR):
+        clave = t[propias] << 9 | t[rivales]
+        if mejor < 0 or clave < mejor:
+            mejor, mejor_s = clave, s
+    return mejor, mejor_s
+
+
+def _negamax(propias: int, rivales: int, alfa: int, beta: int) -> int:
+    """Valor de la posición para quien mueve (propias)."""
+    ocupadas = propias | rivales
+    if _GANA[rivales]:
+        # El rival acaba de ganar; se castiga menos cuanto más tarde ocurra
+        return -(10 - bin(ocupadas).count("1"))
+    if ocupadas == TABLERO_LLENO:
+        return 0
+
+    clave, _ = clave_canonica(propias, rivales)
+    entrada = _transposicion.get(clave)
+    if entrada:
+        valor, tipo = entrada
+        if tipo == _EXACTO:
+            return valor
+        if tipo == _COTA_INF:
+            alfa = max(alfa, valor)
+        else:
+            beta = min(beta, valor)
+        if alfa >= beta:
+            return valor
+
+    alfa_original = alfa
+    mejor = -100
+    for pos in _ORDEN:
+        bit = 1 << pos
+        if ocupadas & bit:
+            continue
+        valor = -_negamax(rivales, propias | bit, -beta, -alfa)
+        if valor > mejor:
+            mejor = valor
+        if mejor > alfa:
+            alfa = mejor
+        if alfa >= beta:
+            break
+
+    if mejor <= alfa_original:
+        tipo = _COTA_SUP
+    elif mejor >= beta:
+        tipo = _COTA_INF
+    else:
+        tipo = _EXACTO
+    _transposicion[clave] = (mejor, tipo)
+    return mejor
+
+
+def _mejor_jugada(propias: int, rivales: int) -> int:
+    """Busca la mejor jugada con ventana completa (valores exactos)."""
+    ocupadas = propias | rivales
+    mejor, mejor_pos = -100, _SIN_JUGADA
+    for pos in _ORDEN:
+        bit = 1 << pos
+        if ocupadas & bit:
+            continue
+        valor = -_negamax(rivales, propias | bit, -100, 100)
+        if valor > mejor:
+            mejor, mejor_pos = valor, pos
+    return mejor_pos
+
+
+def precalcular() -> int:
+    """Resuelve todas las posiciones alcanzables. Devuelve cuántas hay."""
+    global _tabla
+    if _tabla:
+        return sum(1 for b in _tabla if b != _SIN_JUGADA)
+
+    tabla = bytearray([_SIN_JUGADA]) * (1 << 18)
+    canonicas: Dict[int, int] = {}
+    pendientes = [(0, 0)]
+    vistas = {0}
+    while pendientes:
+        x, o = pendientes.pop()
+        ocupadas = x | o
+        if _GANA[x] or _GANA[o] or ocupadas == TABLERO_LLENO:
+            continue
+        turno_x = bin(x).count("1") == bin(o).count("1")
+        propias, rivales = (x, o) if turno_x else (o, x)
+
+        clave, s = clave_canonica(propias, rivales)
+        if clave not in canonicas:
+            canonicas[clave] = _mejor_jugada(clave >> 9, clave & TABLERO_LLENO)
+        # Se deshace la simetría para llevar la jugada al tablero original
+        tabla[x << 9 | o] = SIMETRIAS[s].index(canonicas[clave])
+
+        for pos in range(9):
+            bit = 1 << pos
+            if ocupadas & bit:
+                continue
+            hijo = (x | bit, o) if turno_x else (x, o | bit)
+            indice = hijo[0] << 9 | hijo[1]
+            if indice not in vistas:
+                vistas.add(indice)
+                pendientes.append(hijo)
+
+    _tabla = tabla
+    _transposicion.clear()
+    return sum(1 for b in _tabla if b != _SIN_JUGADA)
+
+
+def jugada_para(juego: TrikiGame) -> int:
+    """Mejor jugada para el jugador en turno de una partida 3×3."""
+    if juego.size != 3 or juego.win_length != 3:
+        raise ValueError("El solver solo juega en tableros 3×3")
+    if not _tabla:
+        precalcular()
+    pos = _tabla[juego.x_bits << 9 | juego.o_bits]
+    if pos == _SIN_JUGADA:
+        raise ValueError("La partida no admite más jugadas")
+    return pos
@@ -1,6 +1,20 @@
-async function cargarTabla() {
-      const res = await fetch('/api/historico');
+let siguiente = null;
+    let filas = "";
+
+    async function cargarTabla() {
+      const url = siguiente ? `/api/historico?cursor=${encodeURIComponent(siguiente)}` : '/api/historico';
+      const res = await fetch(url);
       const data = await res.json();
+      siguiente = data.siguiente;
+      for (const p of data.partidas) {
+        filas += `
+          <tr class="hover:bg-gray-700">
+            <td class="py-2 px-4 border-b border-gray-700">${p.jugador1}</td>
+            <td class="py-2 px-4 border-b border-gray-700">${p.jugador2}</td>
+            <td class="py-2 px-4 border-b border-gray-700">${p.ganador}</td>
+            <td class="py-2 px-4 border-b border-gray-700">${p.fecha}</td>
+          </tr>`;
+      }
       let html = `
         <table class="min-w-full border border-gray-700 text-center">
           <thead class="bg-gray-700">
@@ -11,17 +25,10 @@ async function cargarTabla() {
               <th class="py-3 px-4 border-b border-gray-600">Fecha</th>
             </tr>
           </thead>
-          <tbody>`;
-      for (const p of data) {
-        html += `
-          <tr class="hover:bg-gray-700">
-            <td class="py-2 px-4 border-b border-gray-700">${p.jugador1}</td>
-            <td class="py-2 px-4 border-b border-gray-700">${p.jugador2}</td>
-            <td class="py-2 px-4 border-b border-gray-700">${p.ganador}</td>
-            <td class="py-2 px-4 border-b border-gray-700">${p.fecha}</td>
-          </tr>`;
+          <tbody>${filas}</tbody></table>`;
+      if (siguiente) {
+        html += `<button onclick="cargarTabla()" class="mt-4 bg-violet-600 hover:bg-violet-700 text-white px-4 py-2 rounded-md">Cargar más</button>`;
       }
-      html += `</tbody></table>`;
       document.getElementById('tabla-container').innerHTML = html;
     }
     cargarTabla();
\ No newline at end of file
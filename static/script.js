@@ -8,6 +8,14 @@ const menu = document.getElementById('menu');
     let symbol = null;
     let currentPlayer = null;
     let partidaId = null;
+    // Estado local para el protocolo v2: se aplican deltas sobre el tablero
+    let board = [];
+    let seq = 0;
+    let winner = null;
+    // Reanudación: con el token de join se recupera el asiento tras un corte
+    let name = null;
+    let resumeToken = null;
+    let intentos = 0;
 
     document.getElementById('createBtn').onclick = async () => {
       const res = await fetch('/api/create_partida', {method: 'POST'});
@@ -17,8 +25,10 @@ const menu = document.getElementById('menu');
     };
 
     document.getElementById('joinBtn').onclick = () => {
-      const name = document.getElementById('name').value.trim();
+      name = document.getElementById('name').value.trim();
       partidaId = document.getElementById('partidaId').value.trim();
+      // Si la página se recargó, el token guardado recupera el asiento
+      resumeToken = sessionStorage.getItem(`triki:${partidaId}:${name}`);
 
       if (!name || !partidaId) {
         alert('⚠️ Ingresa nombre e ID de partida');
@@ -29,43 +39,99 @@ const menu = document.getElementById('menu');
       juego.classList.remove('hidden');
       tituloPartida.textContent = `ID: ${partidaId}`;
 
+      conectar();
+    };
+
+    function conectar() {
       ws = new WebSocket(`ws://${location.host}/ws/${partidaId}`);
 
       ws.onopen = () => {
-        ws.send(JSON.stringify({action: "join", name}));
+        if (resumeToken) {
+          ws.send(JSON.stringify({action: "resume", name, token: resumeToken, seq, protocol: 2}));
+        } else {
+          ws.send(JSON.stringify({action: "join", name, protocol: 2}));
+        }
       };
 
       ws.onmessage = (e) => {
         const msg = JSON.parse(e.data);
         if (msg.type === "info") {
           if (msg.symbol) symbol = msg.symbol;
+          if (msg.resume_token) {
+            resumeToken = msg.resume_token;
+            sessionStorage.setItem(`triki:${partidaId}:${name}`, resumeToken);
+          }
+          intentos = 0;
           turnoDiv.textContent = msg.message;
         }
-        if (msg.type === "state") {
-          renderBoard(msg.board, msg.current_player, msg.winner);
+        if (msg.t === "s") {
+          board = Array.from(msg.board, c => c === '.' ? '' : c);
+          seq = msg.seq;
+          renderBoard(board, msg.turn, msg.winner);
+        }
+        if (msg.t === "m") {
+          if (msg.seq !== seq + 1) {
+            // Se perdió una jugada: se pide una foto completa
+            ws.send(JSON.stringify({action: "resync"}));
+            return;
+          }
+          seq = msg.seq;
+          board[msg.pos] = msg.sym;
+          tableroDiv.children[msg.pos].textContent = msg.sym;
+          currentPlayer = msg.sym === 'X' ? 'O' : 'X';
+          winner = msg.winner;
+          actualizarTurno();
+        }
+        if (msg.type === "error" && msg.resume === false) {
+          // El asiento ya no estaba guardado: se entra de nuevo
+          resumeToken = null;
+          sessionStorage.removeItem(`triki:${partidaId}:${name}`);
+          ws.send(JSON.stringify({action: "join", name, protocol: 2}));
+          return;
         }
         if (msg.type === "error") alert(msg.message);
       };
 
-      ws.onclose = () => {
+      ws.onclose = (e) => {
+        if (e.code === 4001) {
+          // La sesión siguió en otra pestaña: reconectar aquí se la quitaría
+          turnoDiv.textContent = "❌ Sesión abierta en otra conexión";
+          return;
+        }
+        if (resumeToken && intentos < 6) {
+          // Espera creciente con azar para que los clientes no vuelvan todos a la vez
+          const espera = Math.min(1000 * 2 ** intentos, 15000) * (0.5 + Math.random());
+          intentos++;
+          turnoDiv.textContent = "🔄 Reconectando...";
+          setTimeout(conectar, espera);
+          return;
+        }
         turnoDiv.textContent = "❌ Conexión cerrada";
       };
-    };
+    }
 
-    function renderBoard(board, current, winner) {
+    function renderBoard(board, current, ganador) {
       tableroDiv.innerHTML = '';
       currentPlayer = current;
+      winner = ganador;
+      const tamano = Math.round(Math.sqrt(board.length));
+      tableroDiv.style.gridTemplateColumns = `repeat(${tamano}, minmax(0, 1fr))`;
+      const celda = tamano > 3 ? "w-8 h-8 text-base" : "w-20 h-20 text-3xl";
       board.forEach((cell, i) => {
         const btn = document.createElement('button');
         btn.textContent = cell || '';
-        btn.className = "w-20 h-20 text-3xl border border-gray-400 bg-white rounded hover:bg-gray-200";
+        btn.className = `${celda} border border-gray-400 bg-white rounded hover:bg-gray-200`;
         btn.onclick = () => makeMove(i);
         tableroDiv.appendChild(btn);
       });
+      actualizarTurno();
+    }
+
+    function actualizarTurno() {
       if (winner) {
         turnoDiv.textContent = winner.includes('Empate') ? "🤝 Empate!" : `🏁 ${winner}`;
       } else {
-        turnoDiv.textContent = (symbol === current) ? "Tu turno!" : "Esperando rival...";
+        turnoDiv.textContent = (symbol === currentPlayer) ? "Tu turno!" : "Esperando rival...";
       }
     }
 
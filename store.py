@@ -0,0 +1,393 @@
+# store.py
+"""Estado de las salas y difusión de mensajes entre workers.
+
+`MemoryGameStore` guarda todo en el proceso (un solo worker de uvicorn).
+`SQLiteGameStore` guarda cada sala en un archivo SQLite en modo WAL que
+comparten todos los workers; las actualizaciones son transacciones
+`BEGIN IMMEDIATE` y la difusión es una tabla de eventos que cada worker
+consulta cada pocos milisegundos, de modo que los jugadores de una misma
+partida pueden estar conectados a workers distintos.
+
+Se elige con la variable de entorno TRIKI_GAME_STORE:
+    memoria                (por defecto)
+    sqlite:///ruta/al.db
+
+Las salas sin actividad durante TRIKI_SALA_TTL_SEG segundos se eliminan en
+un barrido periódico (cada TRIKI_BARRIDO_SEG), y si hay más de
+TRIKI_MAX_SALAS se desalojan las usadas hace más tiempo. Nunca se eliminan
+salas con sockets conectados a este worker.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Collection, Dict, List, Optional
+
+from game_logic import TrikiGame
+
+# Canal interno para avisos entre workers que no van a los sockets
+CANAL_SISTEMA = "__sistema__"
+
+Entregar = Callable[[str, dict], Awaitable[None]]
+
+
+@dataclass(slots=True)
+class Sala:
+    """Estado compartido de una partida: el juego y quién ocupa cada asiento."""
+
+    juego: TrikiGame = field(default_factory=TrikiGame)
+    # nombre -> "X", "O" o None (espectador)
+    asientos: Dict[str, Optional[str]] = field(default_factory=dict)
+    # Número de secuencia del último cambio de tablero difundido
+    seq: int = 0
+    # Número del último evento registrado en la bitácora (eventlog.py)
+    eventos: int = 0
+    # Jugadas de la partida en curso: [nombre, posición, timestamp]
+    jugadas: List[list] = field(default_factory=list)
+    # Símbolo que juega el solver en modo contra la CPU (None: sin CPU)
+    cpu: Optional[str] = None
+    ultima_actividad: float = field(default_factory=time.monotonic)
+    # Sesiones reanudables: nombre -> sha256 del token entregado al unirse
+    reanudacion: Dict[str, str] = field(default_factory=dict)
+    # Jugadores desconectados cuyo asiento se guarda: nombre -> plazo (time.time())
+    ausentes: Dict[str, float] = field(default_factory=dict)
+    # Últimos mensajes de jugada, para reenviar a quien reanuda la sesión
+    recientes: List[dict] = field(default_factory=list)
+
+    def nombre_de(self, simbolo: str) -> Optional[str]:
+        return next((n for n, s in self.asientos.items() if s == simbolo), None)
+
+    def to_dict(self, sesiones: bool = True) -> dict:
+        """`sesiones=False` omite lo que solo vale mientras el servidor corre
+        (tokens, plazos de gracia y mensajes recientes), p. ej. para la bitácora."""
+        data = {
+            "juego": self.juego.to_dict(),
+            "asientos": self.asientos,
+            "seq": self.seq,
+            "eventos": self.eventos,
+            "jugadas": self.jugadas,
+            "cpu": self.cpu,
+        }
+        if sesiones:
+            data["reanudacion"] = self.reanudacion
+            data["ausentes"] = self.ausentes
+            data["recientes"] = self.recientes
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Sala":
+        return cls(
+            TrikiGame.from_dict(data["juego"]),
+            data["asientos"],
+            data.get("seq", 0),
+            data.get("eventos", 0),
+            data.get("jugadas", []),
+            data.get("cpu"),
+            reanudacion=data.get("reanudacion", {}),
+            ausentes=data.get("ausentes", {}),
+            recientes=data.get("recientes", []),
+        )
+
+
+class GameStore(ABC):
+    """Interfaz común de los backends de estado."""
+
+    def __init__(self, ttl_seg: float = 1800, max_salas: int = 10000, barrido_seg: float = 60):
+        self.ttl_seg = ttl_seg
+        self.max_salas = max_salas
+        self.barrido_seg = barrido_seg
+        self.expiradas = 0
+        self.desalojadas = 0
+        self._entregar: Optional[Entregar] = None
+        self._en_uso: Collection[str] = ()
+        self._barrido: Optional[asyncio.Task] = None
+
+    async def iniciar(self, entregar: Entregar, en_uso: Optional[Collection[str]] = None):
+        """`entregar(partida_id, mensaje)` reparte un mensaje a los sockets locales;
+        `en_uso` contiene las salas con sockets en este worker (se consulta en vivo)."""
+        self._entregar = entregar
+        if en_uso is not None:
+            self._en_uso = en_uso
+        self._barrido = asyncio.create_task(self._barrer())
+
+    async def detener(self):
+        if self._barrido:
+            self._barrido.cancel()
+            self._barrido = None
+
+    async def _barrer(self):
+        while True:
+            await asyncio.sleep(self.barrido_seg)
+            await self.expirar()
+
+    @abstractmethod
+    async def expirar(self):
+        """Elimina las salas inactivas y las que sobran por encima del límite."""
+
+    @abstractmethod
+    async def contar(self) -> int:
+        ...
+
+    async def metricas(self) -> dict:
+        return {
+            "salas_vivas": await self.contar(),
+            "salas_expiradas": self.expiradas,
+            "salas_desalojadas": self.desalojadas,
+            "max_salas": self.max_salas,
+            "ttl_seg": self.ttl_seg,
+        }
+
+    @abstractmethod
+    async def crear(self, partida_id: str, tamano: int = 3, en_linea: int = 3):
+        ...
+
+    @abstractmethod
+    async def obtener(self, partida_id: str) -> Optional[Sala]:
+        """La sala para solo leerla (sin transacción de escritura), o None si no existe."""
+
+    @abstractmethod
+    async def actualizar(self, partida_id: str, fn: Callable[[Sala], object]):
+        """Ejecuta `fn(sala)` de forma atómica y guarda el resultado.
+
+        `fn` no debe esperar nada (se puede ejecutar en otro hilo). Si la
+        sala no existe se crea con un tablero 3×3.
+        """
+
+    @abstractmethod
+    async def publicar(self, partida_id: str, mensaje: dict):
+        ...
+
+    @abstractmethod
+    async def restaurar(self, partida_id: str, sala: Sala):
+        """Vuelve a cargar una sala reconstruida desde la bitácora si no existe."""
+
+
+class MemoryGameStore(GameStore):
+    def __init__(self, **limites):
+        super().__init__(**limites)
+        # Ordenadas de la menos a la más recientemente usada
+        self.salas: "OrderedDict[str, Sala]" = OrderedDict()
+
+    def _tocar(self, partida_id: str, sala: Sala):
+        sala.ultima_actividad = time.monotonic()
+        self.salas.move_to_end(partida_id)
+
+    def _respetar_limite(self, proteger: Optional[str] = None):
+        """Desaloja las salas menos usadas que no estén en uso. `proteger` es la
+        sala recién insertada: si todas las demás están en uso, se pasa del
+        límite hasta el próximo barrido en vez de desalojarla al crearla."""
+        if len(self.salas) <= self.max_salas:
+            return
+        for partida_id in list(self.salas):
+            if len(self.salas) <= self.max_salas:
+                break
+            if partida_id not in self._en_uso and partida_id != proteger:
+                del self.salas[partida_id]
+                self.desalojadas += 1
+
+    async def crear(self, partida_id: str, tamano: int = 3, en_linea: int = 3):
+        self.salas[partida_id] = Sala(TrikiGame(tamano, en_linea))
+        self._tocar(partida_id, self.salas[partida_id])
+        self._respetar_limite(proteger=partida_id)
+
+    async def obtener(self, partida_id: str) -> Optional[Sala]:
+        sala = self.salas.get(partida_id)
+        if sala is not None:
+            self._tocar(partida_id, sala)
+        return sala
+
+    async def actualizar(self, partida_id: str, fn: Callable[[Sala], object]):
+        sala = self.salas.get(partida_id)
+        if sala is None:
+            sala = self.salas[partida_id] = Sala()
+            self._respetar_limite(proteger=partida_id)
+        self._tocar(partida_id, sala)
+        return fn(sala)
+
+    async def publicar(self, partida_id: str, mensaje: dict):
+        await self._entregar(partida_id, mensaje)
+
+    async def restaurar(self, partida_id: str, sala: Sala):
+        if partida_id not in self.salas:
+            self.salas[partida_id] = sala
+            self._tocar(partida_id, sala)
+
+    async def expirar(self):
+        limite = time.monotonic() - self.ttl_seg
+        for partida_id, sala in list(self.salas.items()):
+            if sala.ultima_actividad >= limite:
+                break
+            if partida_id not in self._en_uso:
+                del self.salas[partida_id]
+                self.expiradas += 1
+        self._respetar_limite()
+
+    async def contar(self) -> int:
+        return len(self.salas)
+
+
+class SQLiteGameStore(GameStore):
+    RETENCION_EVENTOS_SEG = 60
+
+    def __init__(self, ruta: str, intervalo_ms: int = 20, **limites):
+        super().__init__(**limites)
+        self.ruta = ruta
+        self.intervalo = intervalo_ms / 1000
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._ultimo_evento = 0
+        self._tarea: Optional[asyncio.Task] = None
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.ruta, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS salas (partida_id TEXT PRIMARY KEY, estado TEXT, actualizado REAL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS eventos ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, partida_id TEXT, mensaje TEXT, creado REAL)"
+        )
+        self._conn = conn
+        self._ultimo_evento = conn.execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+
+    async def iniciar(self, entregar: Entregar, en_uso: Optional[Collection[str]] = None):
+        await asyncio.to_thread(self._abrir)
+        await super().iniciar(entregar, en_uso)
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def detener(self):
+        await super().detener()
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _guardar(self, partida_id: str, sala: Sala):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO salas (partida_id, estado, actualizado) VALUES (?, ?, ?)",
+            (partida_id, json.dumps(sala.to_dict()), time.time()),
+        )
+
+    async def crear(self, partida_id: str, tamano: int = 3, en_linea: int = 3):
+        def crear():
+            with self._lock:
+                self._guardar(partida_id, Sala(TrikiGame(tamano, en_linea)))
+        await asyncio.to_thread(crear)
+
+    async def obtener(self, partida_id: str) -> Optional[Sala]:
+        def leer():
+            with self._lock:
+                fila = self._conn.execute(
+                    "SELECT estado FROM salas WHERE partida_id = ?", (partida_id,)
+                ).fetchone()
+            return Sala.from_dict(json.loads(fila[0])) if fila else None
+        return await asyncio.to_thread(leer)
+
+    async def actualizar(self, partida_id: str, fn: Callable[[Sala], object]):
+        def transaccion():
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    fila = self._conn.execute(
+                        "SELECT estado FROM salas WHERE partida_id = ?", (partida_id,)
+                    ).fetchone()
+                    sala = Sala.from_dict(json.loads(fila[0])) if fila else Sala()
+                    resultado = fn(sala)
+                    self._guardar(partida_id, sala)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            return resultado
+        return await asyncio.to_thread(transaccion)
+
+    async def restaurar(self, partida_id: str, sala: Sala):
+        def insertar():
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO salas (partida_id, estado, actualizado) VALUES (?, ?, ?)",
+                    (partida_id, json.dumps(sala.to_dict()), time.time()),
+                )
+        await asyncio.to_thread(insertar)
+
+    async def publicar(self, partida_id: str, mensaje: dict):
+        def insertar():
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO eventos (partida_id, mensaje, creado) VALUES (?, ?, ?)",
+                    (partida_id, json.dumps(mensaje), time.time()),
+                )
+        await asyncio.to_thread(insertar)
+
+    async def expirar(self):
+        # Las salas con sockets en este worker se excluyen vía json_each
+        def borrar():
+            with self._lock:
+                en_uso = json.dumps(list(self._en_uso))
+                expiradas = self._conn.execute(
+                    "DELETE FROM salas WHERE actualizado < ? "
+                    "AND partida_id NOT IN (SELECT value FROM json_each(?))",
+                    (time.time() - self.ttl_seg, en_uso),
+                ).rowcount
+                sobrantes = self._conn.execute("SELECT COUNT(*) FROM salas").fetchone()[0] - self.max_salas
+                desalojadas = 0
+                if sobrantes > 0:
+                    desalojadas = self._conn.execute(
+                        "DELETE FROM salas WHERE partida_id IN ("
+                        "SELECT partida_id FROM salas "
+                        "WHERE partida_id NOT IN (SELECT value FROM json_each(?)) "
+                        "ORDER BY actualizado LIMIT ?)",
+                        (en_uso, sobrantes),
+                    ).rowcount
+            return expiradas, desalojadas
+        expiradas, desalojadas = await asyncio.to_thread(borrar)
+        self.expiradas += expiradas
+        self.desalojadas += desalojadas
+
+    async def contar(self) -> int:
+        def contar():
+            with self._lock:
+                return self._conn.execute("SELECT COUNT(*) FROM salas").fetchone()[0]
+        return await asyncio.to_thread(contar)
+
+    def _leer_eventos(self):
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT id, partida_id, mensaje FROM eventos WHERE id > ? ORDER BY id",
+                (self._ultimo_evento,),
+            ).fetchall()
+            if filas and filas[-1][0] % 1000 < len(filas):
+                # Limpieza ocasional: los eventos viejos ya fueron leídos por todos
+                self._conn.execute(
+                    "DELETE FROM eventos WHERE creado < ?", (time.time() - self.RETENCION_EVENTOS_SEG,)
+                )
+        return filas
+
+    async def _escuchar(self):
+        while True:
+            for evento_id, partida_id, mensaje in await asyncio.to_thread(self._leer_eventos):
+                self._ultimo_evento = evento_id
+                await self._entregar(partida_id, json.loads(mensaje))
+            await asyncio.sleep(self.intervalo)
+
+
+def crear_store() -> GameStore:
+    """Construye el backend indicado en TRIKI_GAME_STORE."""
+    config = os.environ.get("TRIKI_GAME_STORE", "memoria")
+    limites = {
+        "ttl_seg": float(os.environ.get("TRIKI_SALA_TTL_SEG", 1800)),
+        "max_salas": int(os.environ.get("TRIKI_MAX_SALAS", 10000)),
+        "barrido_seg": float(os.environ.get("TRIKI_BARRIDO_SEG", 60)),
+    }
+    if config.startswith("sqlite:///"):
+        return SQLiteGameStore(config[len("sqlite:///"):], **limites)
+    if config == "memoria":
+        return MemoryGameStore(**limites)
+    raise ValueError(f"TRIKI_GAME_STORE no reconocido: {config}")